@@ -3,7 +3,22 @@ To make more ppm files, open a gif or jpg in xv and save as ppm raw.
 Put the three ADTs in their own files.
 """
 from gameboard import *
-from random import *
+import random, os, threading
+from itertools import compress
+from collections import OrderedDict
+
+def makeRandom(seed = None):
+    """Input: None, a seed (a number or a string) or a random.Random.
+       Output: the random.Random given, or a new one seeded with seed"""
+    if isinstance(seed, random.Random):
+        return seed
+    return random.Random(seed)
+
+def deriveSeed(seed, *path):
+    """Output: a seed made from seed and the numbers in path. The same
+       input always gives the same seed, on any machine"""
+    key = '/'.join([str(seed)] + [str(n) for n in path])
+    return random.Random(key).getrandbits(64)
 
 '''------------------------------LINKED LIST ADT------------------------------'''
 class Node:
@@ -75,6 +90,77 @@ class List:
             prevNode = currNode
             currNode = currNode.next
     
+'''-------------------------------INVENTORY----------------------------------'''
+class Inventory:
+    # Purpose: Count the parts the rover carries. The counts are kept in a
+    # dict, so adding, removing and checking a part take the same time
+    # however many kinds of part there are.
+    def __init__(self):
+        """Initialize an empty inventory"""
+        self._counts = {}  # name -> count, oldest kind first
+        self._text = None  # cached str(self), None when out of date
+        self._listener = None
+
+    def __str__(self):
+        """Return one line per part, 'count name', newest kind first"""
+        if self._text == None:
+            self._text = ''.join(['%d %s\n' % (self._counts[name], name)
+                                  for name in reversed(list(self._counts))])
+        return self._text
+
+    def __len__(self):
+        """Return the number of kinds of part held"""
+        return len(self._counts)
+
+    def isEmpty(self):
+        """Check if the inventory is empty"""
+        return not self._counts
+
+    def setListener(self, listener):
+        """Input: a function called as listener(name, oldCount, newCount)
+           every time the count of a part changes"""
+        self._listener = listener
+
+    def getCount(self, name):
+        """Return how many of the part name are held"""
+        return self._counts.get(name, 0)
+
+    def isPartinList(self, name, count):
+        """Check if at least count of the part name are held"""
+        return self._counts.get(name, 0) >= count
+
+    def addPart(self, name, count = 1):
+        """Add count of the part name. Input: name (string) of part"""
+        held = self._counts.get(name, 0)
+        self._counts[name] = held + count
+        self._text = None
+        if self._listener != None:
+            self._listener(name, held, held + count)
+
+    def removePart(self, name, count):
+        """Remove count of the part name. Nothing is removed if fewer are held"""
+        held = self._counts.get(name, 0)
+        if held > count:
+            self._counts[name] = held - count
+        elif held == count and held > 0:
+            del self._counts[name]
+        else:
+            return
+        self._text = None
+        if self._listener != None:
+            self._listener(name, held, held - count)
+
+    def consume(self, needed):
+        """Input: a list of (name, count).
+           Remove all of them and return True if all are held; otherwise
+           remove nothing and return False"""
+        for name, count in needed:
+            if self._counts.get(name, 0) < count:
+                return False
+        for name, count in needed:
+            self.removePart(name, count)
+        return True
+
 '''-----------------------------STACK ADT------------------------------------'''
 class Stack(List):
     # Purpose: Stack ADT to store the entered portal
@@ -94,13 +180,6 @@ class Stack(List):
             return currNode.data
         return None
     
-    def setTypeItem(self,data):
-        """Set all same item to the same type"""
-        currNode = self.head
-        while currNode is not None:
-            currNode.data.setType(data)
-            currNode = currNode.next
-
     def peek(self):
         """Return the top of the stack"""
         return self.head.data
@@ -159,17 +238,27 @@ class Queue:
         self._start = (self._start+1)% self._capacity #O(1)
         self._size -= 1 #O(1)
         return topItem  #O(1)
+
+    def __iter__(self): # total: O(n)
+        """Iterate over the items from the top of the queue to the end"""
+        for i in range(self._size): #O(n)
+            yield self._queue[(self._start+i)% self._capacity] #O(1)
     
 '''-------------------------GAME OBJECTS------------------------------'''
 class Item:
     #Purpose: a parent class that represent and manage all items in the room
+    __slots__ = ('_itemType',) # rooms can hold many items; keep them small
+    _images = {} # item type -> name of its image file, made once per type
     def __init__(self, itemType):
         """Input: a string represent item type. Purpose: initialize object Item"""
         self._itemType = itemType
 
     def getItemImage(self):
         """Input: self. Output: return a string of image file"""
-        return str(self._itemType)+ ".ppm"
+        image = Item._images.get(self._itemType)
+        if image == None:
+            image = Item._images[self._itemType] = str(self._itemType)+ ".ppm"
+        return image
 
     def __str__(self):
         """Represent item by its type"""
@@ -181,10 +270,11 @@ class Item:
         
 class ShipComponent(Item):
     #Purpose: represent ship component object of the game
-    pass
+    __slots__ = ()
 
 class Portal(Item):
     #Purpose: represent portal object of the game
+    __slots__ = ('_myRoom', '_myLocation', '_connectPortal')
     def __init__(self, itemType, myRoom = None, myLocation = None):
         """Input: a string represent item type and portal location.
         Purpose: initialize lass Portal """
@@ -201,82 +291,434 @@ class Portal(Item):
         """Return portal's location"""
         return self._myLocation
 
+    def getRef(self):
+        """Return (room id, location) of the portal, which finds it again
+        even after its room has been written to disk"""
+        return (self._myRoom.id, self._myLocation)
+
+    def isLinked(self):
+        """Is the portal linked to another one?"""
+        return self._connectPortal != None
+
     def getConnectPortal(self):
-        """Return connected portal"""
-        return self._connectPortal
+        """Return connected portal. Its room is read back from disk if
+        it was written out"""
+        other = self._connectPortal
+        if type(other) == tuple:
+            return self._myRoom.getStore().getPortal(other)
+        return other
 
     def setConnectPortal(self,otherPortal):
-        """Set portal pointing to its linked portal"""
+        """Set portal pointing to its linked portal. A portal in a stored
+        room is remembered by reference, so the rooms do not keep each
+        other in memory"""
+        if otherPortal != None and otherPortal.getRoom() != None \
+           and otherPortal.getRoom().id != None:
+            otherPortal = otherPortal.getRef()
         self._connectPortal = otherPortal
+        if self._myRoom != None:
+            self._myRoom._portalChanged(self)
     
 class Part(Item):
-    #Purpose: represent part object of the game
-    pass
-        
+    #Purpose: represent part object of the game. Parts have no state of
+    #their own, so rooms keep one shared Part per type (see Part.get)
+    __slots__ = ()
+    _codes = {}    # part type -> its code in a room's grid
+    _shared = [None] # code -> the shared Part of that type (0 is an empty cell)
+    _lock = threading.Lock() # rooms may be built on another thread
+
+    @staticmethod
+    def get(itemType):
+        """Return the shared Part of itemType"""
+        return Part._shared[Part.code(itemType)]
+
+    @staticmethod
+    def code(itemType):
+        """Return the code of itemType in a room's grid"""
+        code = Part._codes.get(itemType)
+        if code == None:
+            with Part._lock:
+                code = Part._codes.get(itemType)
+                if code == None:
+                    code = len(Part._shared)
+                    if code >= Room.OBJECT:
+                        raise ValueError("too many part types")
+                    Part._shared.append(Part(itemType))
+                    Part._codes[itemType] = code
+        return code
+
 class Room:
-    #Purpose: Represent the room's map. Include a 2D array which
-    #is the copy of the grid
-    def __init__(self, size):
-        """Input: the size of the room (an interger).
+    #Purpose: Represent the room's map. The grid holds one byte per cell:
+    #0 for an empty cell, the code of a part (see Part.code) or OBJECT.
+    #Items with state of their own (portals, ship components) are kept
+    #in a table by cell instead.
+    OBJECT = 255 # the item of the cell is in the table of objects
+    def __init__(self, size, seed = None):
+        """Input: the size of the room (an interger) and a seed or random.Random
+           for what is placed in it.
            Purpose: Initialize the room and create empty 2D array to store the room"""
         self._size = size
-        self.map = [[None for i in range(self._size)] for j in range(self._size)]
+        self._random = makeRandom(seed)
+        self._seed = self._random.getrandbits(64) # rooms behind its portals derive theirs from it
+        self._cells = bytearray(self._size * self._size) # code of each cell, row by row
+        self._objects = {} # r*size+c -> Portal or ShipComponent there
+        self._portals = {}  # r*size+c -> Portal, in the order they were placed
+        self._unlinked = {} # the same for the portals not linked yet
+        self._ship = []     # GridPoint(col,row) of each ship component
+        self._listener = None
+        self.id = None     # given by the RoomStore that keeps the room
+        self._store = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_listener'] = None
+        state['_store'] = None
+        return state
+
+    def getStore(self):
+        """Return the RoomStore that keeps the room, or None"""
+        return self._store
   
     def __getitem__( self, ndxTuple ):
         """Input: position of item([r,c]. 
            Purpose: Get the content of the element at position [i,j] """
-        row = ndxTuple[0]
-        col = ndxTuple[1]
-        return self.map[row][col]
+        i = ndxTuple[0] * self._size + ndxTuple[1]
+        code = self._cells[i]
+        if code != 255: # Room.OBJECT
+            return Part._shared[code]
+        return self._objects[i]
 
     def __setitem__( self, ndxTuple, value ):
         """Input: position of item([r,c] and the replaced value. 
            Purpose: Set the content of the element at position [i,j] """
         row = ndxTuple[ 0 ]
         col = ndxTuple[ 1 ]
-        self.map[row][col] = value
+        i = row * self._size + col
+        if self._cells[i] == Room.OBJECT:
+            del self._objects[i]
+            self._portals.pop(i, None)
+            self._unlinked.pop(i, None)
+        if value == None:
+            self._cells[i] = 0
+        elif type(value) == Part:
+            self._cells[i] = Part.code(str(value))
+        else:
+            self._cells[i] = Room.OBJECT
+            self._objects[i] = value
+            if type(value) == Portal:
+                self._portals[i] = value
+                if not value.isLinked():
+                    self._unlinked[i] = value
+        if self._listener is not None:
+            self._listener(self, row, col)
+
+    def setListener(self, listener):
+        """Input: a function called as listener(room, row, col) every time
+           a cell is set through room[r,c] = value"""
+        self._listener = listener
 
     def placeShipComponent(self):
-        """Purpose: By hardcode, put ship component object into the map (the 2D array)"""
-        self.map[6][7], self.map[7][6], self.map[7][7], self.map[7][8],\
-                        self.map[8][6], self.map[8][8]\
+        """Purpose: By hardcode, put ship component object into the middle of the map (the 2D array)"""
+        m = self._size//2
+        self[m-1,m], self[m,m-1], self[m,m], self[m,m+1],\
+                        self[m+1,m-1], self[m+1,m+1]\
                         = ShipComponent('headbroken'),ShipComponent('handbroken'),\
                         ShipComponent('bodybroken'),ShipComponent('handbroken'),\
                         ShipComponent('legbroken'),ShipComponent('legbroken')
+        self._ship = [GridPoint(m,m-1), GridPoint(m-1,m), GridPoint(m,m),
+                      GridPoint(m+1,m), GridPoint(m-1,m+1), GridPoint(m+1,m+1)]
    
     def placeItems(self, item):
         """Input: a string that indicate the item need to place.
            Purpose: Random the number and position of the input item and put
            those item on the map"""
+        scale = max(1, self._size*self._size//225) # as many per 15x15 cells
         if item == 'Portal':
-            numItem = randint(3,8)
+            numItem = self._random.randint(3*scale,8*scale)
         else:
-            numItem = randint(5,15)
+            numItem = self._random.randint(5*scale,15*scale)
         typePart = ['wrench','resistor','bulb','mushroom','coin']
-        for i in range(numItem):
-            while True:
-                r = randint(0,14)
-                c = randint(0,14)
-                if self.map[r][c] == None:
-                    break
-            if item == 'Portal':
-                self.map[r][c] = Portal('pipe', myRoom = self, myLocation = (r,c))
-            else:
-                self.map[r][c] = Part(typePart[i%5])
+        cells = self.sampleFree(numItem)
+        if item == 'Portal':
+            for cell in cells:
+                r, c = divmod(cell, self._size)
+                self[r,c] = Portal('pipe', myRoom = self, myLocation = (r,c))
+        else: # parts are only codes in the grid
+            codes = [Part.code(part) for part in typePart]
+            for i in range(len(cells)):
+                self._cells[cells[i]] = codes[i%5]
+
+    _FREE = bytes([1] + [0]*255) # translates the grid to 1 for each free cell
+
+    def sampleFree(self, count):
+        """Input: the number of cells wanted.
+           Output: a list of up to count different free cells (as r*size+c),
+           chosen at random. Costs about the same however full the room is."""
+        n = len(self._cells)
+        taken = n - self._cells.count(0)
+        count = min(count, n - taken)
+        if count <= 0:
+            return []
+        if taken <= n//2:
+            # At most taken of count+taken different cells can be in use,
+            # so the free ones among them are enough.
+            cells = self._random.sample(range(n), count + taken)
+            return [cell for cell in cells if self._cells[cell] == 0][:count]
+        free = list(compress(range(n), self._cells.translate(Room._FREE)))
+        return self._random.sample(free, count)
+
+    def furnish(self, isFirst = False):
+        """Input: True for the first room, which holds the ship.
+           Purpose: Place the portals and parts (and the ship) of a new room"""
+        if isFirst == True:
+            self.placeShipComponent()
+        self.placeItems('Portal')
+        self.placeItems('Part')
+
+    def getSeed(self):
+        """Return the seed the rooms behind the room's portals derive theirs from"""
+        return self._seed
+
+    def subSeed(self, location):
+        """Input: location (r,c) of a portal in the room.
+           Output: the seed of the room the portal leads to"""
+        return deriveSeed(self._seed, location[0], location[1])
+
+    def _portalChanged(self, portal):
+        """Keep the unlinked portals up to date when portal is (un)linked"""
+        r, c = portal.getLocation()
+        i = r * self._size + c
+        if self._portals.get(i) is not portal:
+            return
+        if not portal.isLinked():
+            self._unlinked[i] = portal
+        else:
+            self._unlinked.pop(i, None)
+
+    def getPortals(self):
+        """Return a list of the portals in the room"""
+        return list(self._portals.values())
+
+    def getShipComponents(self):
+        """Return a list of (location, ShipComponent) for the ship
+           components in the room, location being a GridPoint(col,row)"""
+        return [(loc, self[loc.y,loc.x]) for loc in self._ship]
+
+    def getUnlinkedPortals(self):
+        """Return a list of the portals in the room that are not linked yet"""
+        return list(self._unlinked.values())
 
     def searchPortal(self):
-        """Search for empty portal in the room. Return its location."""
-        for r in range(self._size):
-            for c in range(self._size):
-                if type(self.map[r][c]) == Portal:
-                    if self.map[r][c].getConnectPortal() == None:
-                        return self.map[r][c].getLocation()
+        """Search for empty portal in the room. Return its location,
+        or None if every portal is linked. Takes constant time: the
+        first unlinked portal placed is returned."""
+        for portal in self._unlinked.values():
+            return portal.getLocation()
+        return None
         
+def makeRooms(size, seeds, isFirst = False):
+    """Input: the size of the rooms, a list of seeds (or random.Random),
+       and True to put the ship in them.
+       Output: a list of furnished rooms, one per seed. A room made here
+       is the same as a room made alone with the same seed."""
+    rooms = []
+    for seed in seeds:
+        room = Room(size, seed)
+        room.furnish(isFirst)
+        rooms.append(room)
+    return rooms
+
+class RoomStore:
+    #Purpose: Keep the rooms of a game. At most limit rooms stay in memory;
+    #the least recently used ones are pickled to files in a temporary
+    #directory and read back when they are needed again. Rooms refer to
+    #each other by id (see Portal.getRef), so a room on disk is not kept
+    #in memory by the rooms linked to it.
+    def __init__(self, limit = 64, listener = None):
+        """Input: the number of rooms to keep in memory (at least 2: the
+           current room and the one just left) and the listener to give
+           every room (see Room.setListener)"""
+        self._limit = max(2, limit)
+        self._listener = listener
+        self._resident = OrderedDict() # id -> Room, least recently used first
+        self._spilled = set()          # ids of the rooms on disk
+        self._nextId = 0
+        self._current = None           # id of the room that is never written out
+        self._directory = None         # made when the first room is written
+        self.loads = 0
+        self.spills = 0
+
+    def add(self, room):
+        """Keep room. Returns the id given to it."""
+        room.id = self._nextId
+        self._nextId += 1
+        room._store = self
+        room.setListener(self._listener)
+        self._resident[room.id] = room
+        self._trim()
+        return room.id
+
+    def getRoom(self, roomId):
+        """Return the room with roomId, reading it back if it is on disk"""
+        room = self._resident.get(roomId)
+        if room != None:
+            self._resident.move_to_end(roomId)
+            return room
+        import pickle # only needed once rooms are spilled; slow to import
+        path = self._path(roomId)
+        f = open(path, 'rb')
+        try:
+            room = pickle.load(f)
+        finally:
+            f.close()
+        os.remove(path)
+        self._spilled.discard(roomId)
+        self.loads += 1
+        room._store = self
+        room.setListener(self._listener)
+        self._resident[roomId] = room
+        self._trim()
+        return room
+
+    def setCurrent(self, roomId):
+        """Keep the room with roomId in memory until another room is made
+        current. The game's current room is changed in place, so it must
+        never be written out."""
+        self._current = roomId
+        self.getRoom(roomId)
+
+    def getPortal(self, ref):
+        """Return the portal of a (room id, location) reference"""
+        return self.getRoom(ref[0])[ref[1]]
+
+    def setLimit(self, limit):
+        """Change the number of rooms kept in memory"""
+        self._limit = max(2, limit)
+        self._trim()
+
+    def getStats(self):
+        """Return the number of rooms in memory and on disk, and how many
+        times rooms were written out and read back"""
+        return {'resident': len(self._resident), 'spilled': len(self._spilled),
+                'spills': self.spills, 'loads': self.loads}
+
+    def _path(self, roomId):
+        return os.path.join(self._directory.name, 'room%d.pickle' % roomId)
+
+    def _trim(self):
+        if len(self._resident) <= self._limit:
+            return
+        import pickle, tempfile # only needed once rooms are spilled; slow to import
+        while len(self._resident) > self._limit:
+            roomId, room = self._resident.popitem(last=False)
+            if roomId == self._current:
+                self._resident[roomId] = room # now the most recently used
+                continue
+            if self._directory == None: # removed when the store is
+                self._directory = tempfile.TemporaryDirectory(prefix='rooms-')
+            f = open(self._path(roomId), 'wb')
+            try:
+                pickle.dump(room, f, pickle.HIGHEST_PROTOCOL)
+            finally:
+                f.close()
+            room._store = None
+            self._spilled.add(roomId)
+            self.spills += 1
+
+class RoomPrefetcher:
+    #Purpose: Build rooms on a worker thread before they are needed. The
+    #room behind a portal depends only on its seed (see Room.subSeed), so
+    #a room built early is the same as one built when the portal is used.
+    def __init__(self, size, count = 8):
+        """Input: the size of the rooms to build and how many to keep ready"""
+        self._size = size
+        self._count = count
+        self._ready = {}       # portal ref -> room built for it
+        self._request = None   # (room, position) to build for, the newest only
+        self._wake = threading.Condition()
+        self._thread = None    # started with the first request
+        self._stopped = False
+        self.built = 0
+        self.hits = 0
+        self.misses = 0
+
+    def want(self, room, position):
+        """Input: the current room and the rover's position in it.
+           Purpose: Build the rooms behind the unlinked portals of room
+           nearest position, instead of the ones wanted before. The
+           portals are chosen on the worker, so this returns at once."""
+        with self._wake:
+            if self._stopped:
+                return
+            self._request = (room, position)
+            self._wake.notify()
+        if self._thread == None:
+            self._thread = threading.Thread(target=self._run, name='RoomPrefetcher')
+            self._thread.daemon = True # never keeps the game from exiting
+            self._thread.start()
+
+    def take(self, ref):
+        """Return the room built for the portal ref, or None if it is not ready"""
+        with self._wake:
+            room = self._ready.pop(ref, None)
+        if room == None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return room
+
+    def close(self):
+        """Stop the worker thread and drop the rooms built so far"""
+        with self._wake:
+            self._stopped = True
+            self._request = None
+            self._ready.clear()
+            self._wake.notify()
+
+    def _nearest(self, room, position):
+        portals = room.getUnlinkedPortals()
+        if len(portals) > self._count:
+            def distance(portal):
+                r, c = portal.getLocation()
+                return abs(r - position.y) + abs(c - position.x)
+            portals = sorted(portals, key=distance)[:self._count]
+        return [portal.getRef() for portal in portals]
+
+    def _run(self):
+        while True:
+            room = None # not kept alive while waiting
+            with self._wake:
+                while self._request == None and not self._stopped:
+                    self._wake.wait()
+                if self._stopped:
+                    return
+                room, position = self._request
+                self._request = None
+            refs = self._nearest(room, position)
+            with self._wake:
+                for ref in list(self._ready):
+                    if ref not in refs:
+                        del self._ready[ref]
+            seed = room.getSeed()
+            for ref in refs:
+                with self._wake:
+                    if self._request != None or self._stopped: # the rover has moved on
+                        break
+                    if ref in self._ready:
+                        continue
+                built = makeRooms(self._size, [deriveSeed(seed, ref[1][0], ref[1][1])])[0]
+                with self._wake:
+                    if not self._stopped:
+                        self._ready[ref] = built
+                        self.built += 1
+
 class Rover:
     #Purpose: Represent the object Rover and store the position of rover
-    def __init__(self, position):
-        """Input: rover position. Purpose: Initialize rover object"""
+    def __init__(self, position, roomSize = 15):
+        """Input: rover position and the size of the rooms.
+           Purpose: Initialize rover object"""
         self._position = position
+        self._roomSize = roomSize
 
     def setPosition(self,newPos):
         """Set new position for rover"""
@@ -289,38 +731,40 @@ class Rover:
     def moveUp(self):
         """Move rover up one step.Return False if the move is illegal"""
         if self._position.y != 0:
-            self._position.y -=1
+            self._position = self._position.moved(0,-1)
             return True
         return False
 
     def moveDown(self):
         """Move rover down one step.Return False if the move is illegal"""
-        if self._position.y != 14:
-            self._position.y +=1
+        if self._position.y != self._roomSize-1:
+            self._position = self._position.moved(0,1)
             return True
         return False
 
     def moveLeft(self):
         """Move rover left one step.Return False if the move is illegal"""
         if self._position.x != 0:
-            self._position.x -=1
+            self._position = self._position.moved(-1,0)
             return True
         return False
 
     def moveRight(self):
         """Move rover right one step.Return False if the move is illegal"""
-        if self._position.x != 14:
-            self._position.x +=1
+        if self._position.x != self._roomSize-1:
+            self._position = self._position.moved(1,0)
             return True
         return False
             
 '''--------------------------------TASK--------------------------------------'''
 class Task:
     # Purpose: Represent the task in the game
-    def __init__(self,name):
-        """Initialize the task with its name and supplies"""
+    def __init__(self,name, seed = None):
+        """Initialize the task with its name and supplies, chosen with
+        a seed or random.Random"""
         self._name = name
         self._supplies = []
+        self._random = makeRandom(seed)
         self.generateSupplies()
 
     def __str__(self):
@@ -343,53 +787,213 @@ class Task:
         typePart = ['wrench','resistor','bulb','mushroom','coin']
         chosenPart = []
         for i in range(3):
-            randomPart = choice(typePart)
+            randomPart = self._random.choice(typePart)
             chosenPart.append(randomPart)
             typePart.remove(randomPart)
         for part in chosenPart:
-            amount = randint(1,3)
+            amount = self._random.randint(1,3)
             self._supplies.append(Node(part,amount))
 
 class Tasks(Queue):
     # Purpose: Represent the queue of task in the game
-    def __init__(self):
-        """Initialize Tasks by inheriting Queue ADT"""
+    def __init__(self, seed = None):
+        """Initialize Tasks by inheriting Queue ADT. The supplies of the
+        tasks are chosen with a seed or random.Random"""
         Queue.__init__(self)
+        self._random = makeRandom(seed)
 
     def generateTaskName(self):
         """Generate all the tasks that the rover need to do."""
         brokenComponent = ['head','hand','leg','body','hand','leg']
         for component in brokenComponent:
-            self.enqueue(Task(component))
+            self.enqueue(Task(component, self._random))
 
-'''-----------------------------MAIN GAME------------------------------------'''
-class Game:
-    #Purpose: Represent the Game object which opperate the game
-    SIZE = 15 # rooms are 15x15
-    def __init__(self):
-        """Purpose: Start the game. Initialize the map and the rover."""
-        self.gui = GameBoard("Iron Mario", self, Game.SIZE)
-        self.map = self._makeRoom(True)
-        self.rover = Rover(Point(randint(0,14),randint(0,14)))
-        self.inventory = List()
+class TaskTracker:
+    # Purpose: Know at all times which tasks can be done with the parts in
+    # the inventory. Each task keeps a count of the parts it still misses,
+    # updated when the inventory changes, so nothing is rescanned.
+    def __init__(self, inventory):
+        """Input: the Inventory to watch"""
+        self._inventory = inventory
+        self._missing = {}   # task -> number of parts it still misses
+        self._needs = {}     # part name -> [(task, count needed)]
+        self._listener = None
+        inventory.setListener(self._partChanged)
+
+    def setListener(self, listener):
+        """Input: a function called as listener(task, ready) every time a
+           task becomes ready or stops being ready"""
+        self._listener = listener
+
+    def add(self, task):
+        """Start tracking task"""
+        missing = 0
+        for part in task.getSupplies():
+            name, count = part.getData(), part.getCount()
+            self._needs.setdefault(name, []).append((task, count))
+            missing += max(0, count - self._inventory.getCount(name))
+        self._missing[task] = missing
+
+    def remove(self, task):
+        """Stop tracking task, once done"""
+        if self._missing.pop(task, None) == None:
+            return
+        for part in task.getSupplies():
+            needs = self._needs[part.getData()]
+            needs[:] = [need for need in needs if need[0] is not task]
+
+    def getMissing(self, task):
+        """Return how many parts task still misses"""
+        return self._missing[task]
+
+    def isReady(self, task):
+        """Check if the inventory holds every part task needs"""
+        return self._missing.get(task) == 0
+
+    def getReadyTasks(self):
+        """Return a list of the tracked tasks that are ready"""
+        return [task for task, missing in self._missing.items() if missing == 0]
+
+    def _partChanged(self, name, old, new):
+        for task, count in self._needs.get(name, ()):
+            change = max(0, count - new) - max(0, count - old)
+            if change == 0:
+                continue
+            before = self._missing[task]
+            after = before + change
+            self._missing[task] = after
+            if self._listener != None and (before == 0) != (after == 0):
+                self._listener(task, after == 0)
+
+'''-----------------------------GAME ENGINE----------------------------------'''
+class GameEngine:
+    #Purpose: Represent the rules of the game and its state: the rooms, the
+    #rover, the inventory, the portals entered and the tasks. It has no
+    #window; front ends such as the GameBoard watch it through listeners.
+    SIZE = 15 # rooms are 15x15 unless another size is given
+    ACTIONS = ('up','down','left','right','wayBack','pickUp','performTask')
+    ROOM_LIMIT = 64 # rooms kept in memory, the others are written to disk
+    PREFETCH = 8    # unlinked portals near the rover whose rooms are built early
+    def __init__(self, size = SIZE, seed = None, roomLimit = ROOM_LIMIT, prefetch = False):
+        """Input: the number of cells per side of a room, a seed or
+           random.Random (the same seed makes the same world), the
+           number of rooms to keep in memory and whether to build the
+           rooms behind nearby portals on a worker thread.
+           Purpose: Initialize the map and the rover."""
+        self.size = size
+        self.random = makeRandom(seed)
+        self.rooms = RoomStore(roomLimit, self._onRoomChange)
+        self.prefetcher = None
+        if prefetch:
+            self.prefetcher = RoomPrefetcher(size, self.PREFETCH)
+        self._flashing = [] # references to the portals showing the way back
+        self._listeners = []
+        self._changes = 0 # changes reported so far
+        self._actions = {'up': self.goUp, 'down': self.goDown,
+                         'left': self.goLeft, 'right': self.goRight,
+                         'wayBack': self.showWayBack, 'pickUp': self.pickUp,
+                         'performTask': self.performTask}
+        self.map = self._makeRoom(True, self.random.getrandbits(64))
+        self.rooms.setCurrent(self.map.id)
+        self.rover = Rover(GridPoint(self.random.randint(0,size-1),
+                                     self.random.randint(0,size-1)), size)
+        self.inventory = Inventory()
         self.enteredPortal = Stack()
-        self.task = Tasks()
+        self.task = Tasks(self.random)
         self.task.generateTaskName()
+        self.tracker = TaskTracker(self.inventory)
+        for task in self.task:
+            self.tracker.add(task)
+        self.tracker.setListener(self._onTaskReady)
+        self._shipRoom = self.map.id # the room with the broken ship
+        self._prefetch()
 
-    def _makeRoom(self,isFirst):
-        """Input: a boolean value indicate if the room is the first room or not.
+    def _makeRoom(self,isFirst,seed):
+        """Input: a boolean value indicate if the room is the first room or not,
+           and the seed of the room.
            Output: the map of the room ( a 2D array)
            Purpose: Create the map of the room"""
-        room = Room(Game.SIZE)
-        if isFirst == True:
-            room.placeShipComponent()
-        room.placeItems('Portal')
-        room.placeItems('Part')
+        room = makeRooms(self.size, [seed], isFirst)[0]
+        self.rooms.add(room)
         return room
-        
-    def startGame(self):
-        self.gui.run()
 
+    def addListener(self, listener):
+        """Input: a function called as listener(event, data) after each
+           change of the game state. Events and their data:
+             'cell'      - (x,y) of a cell of the current room that changed
+             'room'      - id of the new current room (everything changed)
+             'rover'     - ((oldX,oldY),(newX,newY)) when the rover moved
+             'inventory' - None
+             'task'      - None
+             'ready'     - None, when the current task became ready to be
+                           performed or stopped being ready"""
+        self._listeners.append(listener)
+
+    def _notify(self, event, data = None):
+        """Tell every listener about a change"""
+        self._changes += 1
+        for listener in self._listeners:
+            listener(event, data)
+
+    def step(self, action):
+        """Input: one of the names in ACTIONS.
+           Output: True if the action changed the state of the game.
+           Purpose: Perform one action, as a click of its button would"""
+        changes = self._changes
+        try:
+            act = self._actions[action]
+        except KeyError:
+            raise ValueError("unknown action: %r" % (action,))
+        act()
+        return self._changes != changes
+
+    def getState(self):
+        """Output: a dictionary describing what a player can see: the
+           current room, the rover's location and image, the inventory,
+           the current task and whether it can be performed"""
+        return {'room': self.map, 'rover': self.getRoverLocation(),
+                'roverImage': self.getRoverImage(),
+                'inventory': self.getInventory(), 'task': self.getCurrentTask(),
+                'ready': self.isTaskReady(), 'won': self.task.isEmpty()}
+
+    def getRoomStats(self):
+        """Output: how many rooms are in memory and how many on disk
+           (see RoomStore.getStats), and how many were built ahead of
+           time and used"""
+        stats = self.rooms.getStats()
+        if self.prefetcher != None:
+            stats['prefetched'] = self.prefetcher.built
+            stats['prefetchHits'] = self.prefetcher.hits
+            stats['prefetchMisses'] = self.prefetcher.misses
+        return stats
+
+    def _prefetch(self):
+        """Have the rooms behind the unlinked portals nearest the rover
+        built on the worker thread"""
+        if self.prefetcher != None:
+            self.prefetcher.want(self.map, self.rover.getPosition())
+
+    def close(self):
+        """Stop building rooms ahead of time. Call when done with the game"""
+        if self.prefetcher != None:
+            self.prefetcher.close()
+            self.prefetcher = None
+
+    def _onRoomChange(self, room, row, col):
+        """Forward cell changes of the current room to the listeners"""
+        if room is self.map:
+            self._notify('cell', (col,row))
+
+    def _move(self, step):
+        """Input: one of the rover's move methods.
+           Purpose: move the rover, report it and teleport if it lands on a portal"""
+        old = self.rover.getPosition()
+        if step() == True:
+            pos = self.rover.getPosition()
+            self._notify('rover', (old,pos))
+            self._checkPortal(pos)
+            self._prefetch() # the nearest portals change as the rover walks
+        
     def getRoverImage(self):
         """ Called by GUI when screen updates.
             Returns image name (as a string) of the rover. 
@@ -397,9 +1001,21 @@ class Game:
         # Your code goes here, this code is just an example
         return 'mario.ppm'
 
+    def getTileImages(self):
+        """ Called by GUI when it starts.
+            Returns the names of all images getImage and getRoverImage
+            can return, so they can be loaded together. """
+        names = [self.getRoverImage(), 'pipe.ppm', 'pipe-flashing.ppm']
+        for part in ['wrench','resistor','bulb','mushroom','coin']:
+            names.append(part + '.ppm')
+        for component in ['head','hand','body','leg']:
+            names.append(component + '.ppm')
+            names.append(component + 'broken.ppm')
+        return names
+
     def getRoverLocation(self):
         """ Called by GUI when screen updates.
-            Returns location (as a Point). """
+            Returns location (as a GridPoint). """
         return self.rover.getPosition()
 
     def _checkPortal(self,point):
@@ -412,29 +1028,40 @@ class Game:
                 connectPortal = self._makeLinkPortal(thisPortal)
             else:
                 self.map = connectPortal.getRoom() # jump to connected room
+                self.rooms.setCurrent(self.map.id)
                 newPPos = connectPortal.getLocation()
-                self.rover.setPosition(Point(newPPos[1],newPPos[0]))
+                self.rover.setPosition(GridPoint(newPPos[1],newPPos[0]))
             # check and make change on the portal stack if going back
-            if not self.enteredPortal.isEmpty() and self.enteredPortal.peek() == thisPortal: 
+            if not self.enteredPortal.isEmpty() and self.enteredPortal.peek() == thisPortal.getRef():
                 self.enteredPortal.pop()
             else:
-                self.enteredPortal.push(connectPortal)
+                self.enteredPortal.push(connectPortal.getRef())
             self._revertNormal()
+            self._notify('room', self.map.id)
             
     def _revertNormal(self):
-        """Revert all portal(include flashing portal) to normal"""
-        if not self.enteredPortal.isEmpty():
-            self.enteredPortal.setTypeItem('pipe')
+        """Revert all portal(include flashing portal) to normal. Only
+        the portals made to flash are visited, so rooms on disk stay there"""
+        for ref in self._flashing:
+            self.rooms.getPortal(ref).setType('pipe')
+        self._flashing = []
 
     def _makeLinkPortal(self,thisPortal):
         """Make a connect portal to thisPortal"""
-        newRoom = self._makeRoom(False)
+        newRoom = None
+        if self.prefetcher != None:
+            newRoom = self.prefetcher.take(thisPortal.getRef())
+        if newRoom == None:
+            newRoom = self._makeRoom(False, thisPortal.getRoom().subSeed(thisPortal.getLocation()))
+        else:
+            self.rooms.add(newRoom)
         newPPos = newRoom.searchPortal() # search for new portal
         newPortal = newRoom[newPPos[0],newPPos[1]]
         thisPortal.setConnectPortal(newPortal) # set connect portal 
         newPortal.setConnectPortal(thisPortal)
         self.map = newRoom 
-        self.rover.setPosition(Point(newPPos[1],newPPos[0]))
+        self.rooms.setCurrent(newRoom.id)
+        self.rover.setPosition(GridPoint(newPPos[1],newPPos[0]))
         return newPortal
     
     def getImage(self, point):
@@ -443,47 +1070,44 @@ class Game:
 		part, ship component, or portal at the given 
 		coordinates. ('engine.ppm' or 'cake.ppm' or 
 		'portal.ppm', etc) """
-        if self.map[point.y,point.x] != None:
-            return self.map[point.y,point.x].getItemImage()
+        item = self.map[point.y,point.x]
+        if item != None:
+            return item.getItemImage()
 
     def goUp(self):
         """ Called by GUI when button clicked.
             If legal, moves rover. If the robot lands
             on a portal, it will teleport. """
-        check = self.rover.moveUp()
-        if check == True:
-            self._checkPortal(self.getRoverLocation())
+        self._move(self.rover.moveUp)
   
     def goDown(self):
         """ Called by GUI when button clicked. 
             If legal, moves rover. If the robot lands
             on a portal, it will teleport. """
-        check = self.rover.moveDown()
-        if check == True:
-            self._checkPortal(self.getRoverLocation())
+        self._move(self.rover.moveDown)
 
     def goLeft(self):
         """ Called by GUI when button clicked. 
             If legal, moves rover. If the robot lands
             on a portal, it will teleport. """
-        check = self.rover.moveLeft()
-        if check == True:
-            self._checkPortal(self.getRoverLocation())
+        self._move(self.rover.moveLeft)
 
     def goRight(self):
         """ Called by GUI when button clicked. 
             If legal, moves rover. If the robot lands
             on a portal, it will teleport. """
-        check = self.rover.moveRight()
-        if check == True:
-            self._checkPortal(self.getRoverLocation())
+        self._move(self.rover.moveRight)
 
     def showWayBack(self):
         """ Called by GUI when button clicked.
             Flash the portal leading towards home. """
         if not self.enteredPortal.isEmpty():
-            prevPortal = self.enteredPortal.peek()
+            prevPortal = self.rooms.getPortal(self.enteredPortal.peek())
             prevPortal.setType('pipe-flashing')
+            self._flashing.append(prevPortal.getRef())
+            if prevPortal.getRoom() is self.map:
+                loc = prevPortal.getLocation()
+                self._notify('cell', (loc[1],loc[0]))
 
     def getInventory(self):
         """ Called by GUI when inventory updates.
@@ -504,6 +1128,7 @@ class Game:
         if type(item) == Part:
             self.inventory.addPart(str(item))
             self.map[pos.y,pos.x] = None
+            self._notify('inventory')
 
     def getCurrentTask(self):
         """ Called by GUI when task updates.
@@ -522,19 +1147,59 @@ class Game:
             is on the relevant broken ship piece, then fixes
             ship piece and removes parts from inventory. If
             we run out of tasks, we win. """
+        if self.task.isEmpty(): # nothing left to do
+            return
         task = self.task.peek()
         position = self.rover.getPosition()
         if str(self.map[position.y,position.x]) == task.getName() + 'broken':
-            for part in task.getSupplies():
-                if not self.inventory.isPartinList(part.getData(),part.getCount()):
-                    return
-            for part in task.getSupplies():
-                self.inventory.removePart(part.getData(),part.getCount())
+            needed = [(part.getData(), part.getCount()) for part in task.getSupplies()]
+            if not self.inventory.consume(needed):
+                return
             self.task.dequeue()
+            self.tracker.remove(task)
             self.map[position.y,position.x].setType(task.getName())
+            self._notify('cell', (position.x,position.y))
+            self._notify('inventory')
+            self._notify('task')
+            self._notify('ready')
+
+    def isTaskReady(self):
+        """Output: True if the inventory holds every part the current
+           task needs"""
+        return not self.task.isEmpty() and self.tracker.isReady(self.task.peek())
+
+    def getReadyCells(self):
+        """Output: the cells, as GridPoint(x,y), of the current room that
+           hold a broken ship component the current task can fix now"""
+        if self.map.id != self._shipRoom or not self.isTaskReady():
+            return []
+        broken = self.task.peek().getName() + 'broken'
+        return [loc for loc, component in self.map.getShipComponents()
+                if str(component) == broken]
+
+    def _onTaskReady(self, task, ready):
+        """Tell the listeners when the current task becomes ready or
+           stops being ready"""
+        if not self.task.isEmpty() and task is self.task.peek():
+            self._notify('ready')
 
     # Put other methods here as needed.
 
+'''-----------------------------MAIN GAME------------------------------------'''
+class Game(GameEngine):
+    #Purpose: Represent the Game object which opperate the game in a window
+    def __init__(self, size = GameEngine.SIZE, seed = None, roomLimit = GameEngine.ROOM_LIMIT,
+                 prefetch = True):
+        """Input: the number of cells per side of a room, a seed or
+           random.Random, the number of rooms to keep in memory and
+           whether to build rooms ahead of time.
+           Purpose: Start the game and open its window."""
+        GameEngine.__init__(self, size, seed, roomLimit, prefetch)
+        self.gui = GameBoard("Iron Mario", self, size)
+
+    def startGame(self):
+        self.gui.run()
+
 # Put other classes here or in other files as needed.
 '''-----------------------------TEST QUEUE METHOD----------------------------'''
 def testQueue():
@@ -558,9 +1223,42 @@ def testQueue():
     myQueue.dequeue()
     print('Dequeue: ',myQueue)
 
+def testShipRoomPickle():
+    """Test that the room with the ship is the same after being written
+    to disk and read back, as the RoomStore does"""
+    import pickle
+    room = makeRooms(GameEngine.SIZE, [42], True)[0]
+    again = pickle.loads(pickle.dumps(room, pickle.HIGHEST_PROTOCOL))
+    before = [(loc, str(part)) for loc, part in room.getShipComponents()]
+    after = [(loc, str(part)) for loc, part in again.getShipComponents()]
+    assert before == after and len(after) == 6, (before, after)
+    assert type(after[0][0]) == GridPoint
+    print('Ship room pickle: ok')
+
+def testRoomSpill(seed = 9, actions = 60000):
+    """Test that a game keeping only 3 rooms in memory plays the same as
+    one keeping every room, when both are given the same seed and actions.
+    With seed 9 the rover goes back to the ship room after it was spilled"""
+    spilling = GameEngine(seed = seed, roomLimit = 3)
+    keeping = GameEngine(seed = seed, roomLimit = actions)
+    moves = random.Random(seed)
+    for i in range(actions):
+        action = moves.choice(GameEngine.ACTIONS)
+        assert spilling.step(action) == keeping.step(action), i
+        if i % 100 == 0 or i == actions - 1:
+            a, b = spilling.getState(), keeping.getState()
+            assert a['room'].id == b['room'].id, i
+            assert bytes(a['room']._cells) == bytes(b['room']._cells), i
+            for key in ('rover', 'inventory', 'task', 'ready', 'won'):
+                assert a[key] == b[key], (i, key)
+    stats = spilling.getRoomStats()
+    assert stats['loads'] > 0 and keeping.getRoomStats()['spills'] == 0, stats
+    print('Room spill: ok', stats)
+
 '''-----------------------------LAUNCH GAME-------------------------------------'''
 
 """ Launch the game. """
-#testQueue()
-g = Game()
-g.startGame() # This does not return until the game is over
+if __name__ == "__main__": # importing Game only defines the classes
+    #testQueue()
+    g = Game()
+    g.startGame() # This does not return until the game is over
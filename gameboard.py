@@ -34,10 +34,208 @@ CREDITS: Original file by Lea Wittie. Bug in quit function fixed by Matt Rogge '
 """
 from graphics import *
 from functools import partial
+from collections import deque, OrderedDict
+import time, math
+
+class FrameStats:
+    """ Rolling record of the last few GUI updates (frames). For every frame
+        it keeps the wall time in milliseconds, the number of tiles touched,
+        the textures loaded and the number of times the window was flushed. """
+
+    FIELDS = ('ms', 'tiles', 'textures', 'flushes')
+
+    def __init__(self, size=1000):
+        """ Keeps the last size frames """
+        self.frames = deque(maxlen=size)
+        self.count = 0 # frames recorded in total
+
+    def add(self, ms, tiles, textures, flushes):
+        """ Record one frame """
+        self.frames.append((ms, tiles, textures, flushes))
+        self.count += 1
+
+    def percentile(self, p, field='ms'):
+        """ Returns the p-th percentile (nearest rank) of a field over the
+            recorded frames, or 0 if there are none """
+        if not self.frames:
+            return 0
+        i = self.FIELDS.index(field)
+        values = sorted(frame[i] for frame in self.frames)
+        rank = max(0, min(len(values) - 1, math.ceil(p/100.0 * len(values)) - 1))
+        return values[rank]
+
+    def histogram(self, bucket=1.0):
+        """ Returns a dictionary of frame times, rounded down to multiples
+            of bucket ms, to the number of frames that took that long """
+        counts = {}
+        for frame in self.frames:
+            key = int(frame[0] // bucket) * bucket
+            counts[key] = counts.get(key, 0) + 1
+        return dict(sorted(counts.items()))
+
+    def summary(self):
+        """ Returns percentiles of the frame time and totals of the other fields """
+        n = len(self.frames)
+        result = {'frames': self.count, 'window': n,
+                  'p50': self.percentile(50), 'p95': self.percentile(95),
+                  'p99': self.percentile(99),
+                  'max': max([frame[0] for frame in self.frames] or [0])}
+        for i in range(1, len(self.FIELDS)):
+            result[self.FIELDS[i]] = sum(frame[i] for frame in self.frames)
+        return result
+
+    def __str__(self):
+        s = self.summary()
+        return ('frames %d (last %d)\n' % (s['frames'], s['window']) +
+                'p50 %.2f ms  p95 %.2f ms\n' % (s['p50'], s['p95']) +
+                'p99 %.2f ms  max %.2f ms\n' % (s['p99'], s['max']) +
+                'tiles %d  textures %d  flushes %d' % (s['tiles'], s['textures'], s['flushes']))
+
+    def dump(self, filename):
+        """ Write the summary, the histogram and every frame to a JSON file """
+        import json # only needed here; keeps importing gameboard quick
+        data = {'summary': self.summary(),
+                'histogram': [[ms, n] for ms, n in self.histogram().items()],
+                'fields': self.FIELDS,
+                'frames': list(self.frames)}
+        f = open(filename, 'w')
+        try:
+            json.dump(data, f, indent=1)
+        finally:
+            f.close()
+
+class RoomLayer:
+    """ What the map shows of one room, the map with the tiles on it,
+        composited into a single image. A room is then one canvas item
+        however full it is. The layer keeps its own copy of the pixels,
+        so a cell can be repainted without reading the image back.
+
+        The layer shows view x view cells of the room, starting with the
+        room cell origin in the top left corner. The map image repeats
+        every view cells, so it scrolls with the room. """
+
+    FULL = 16 # with more stale cells than this the whole image is written
+
+    def __init__(self, anchor, background, width, height, corner, tileLength, view):
+        """ anchor is the centre of the layer on the window, background
+            the RGB bytes of the empty map and corner the top left corner
+            of the first cell (window coordinates) """
+        self.width = width
+        self.height = height
+        self.left = int(round(anchor.x)) - width//2
+        self.top = int(round(anchor.y)) - height//2
+        self.cellX = int(corner[0]) - self.left
+        self.cellY = int(corner[1]) - self.top
+        self.tileLength = tileLength
+        self.view = view
+        self.origin = (0,0)
+        self.background = background
+        self.pixels = bytearray(background)
+        self.tiles = {}     # (x,y) of a view cell -> name of the tile painted there
+        self.stale = set()  # cells painted but not yet written to the image
+        self.redraw = True  # write the whole image on the next flush
+        self.image = Image(anchor, width, height)
+
+    def isPainted(self, cell):
+        return cell in self.tiles
+
+    def getTile(self, cell):
+        """ Returns the name of the tile painted in cell, or None """
+        return self.tiles.get(cell)
+
+    def _corner(self, cell):
+        return (self.cellX + cell[0]*self.tileLength,
+                self.cellY + cell[1]*self.tileLength)
+
+    def paint(self, cell, name, tile):
+        """ Paint the map under cell and tile, the (width, height, RGB
+            bytes) of image name, centred on it. Only the pixels are
+            changed; flush() shows them. """
+        x, y = self._corner(cell)
+        sx, sy = self._corner(((self.origin[0] + cell[0]) % self.view,
+                               (self.origin[1] + cell[1]) % self.view))
+        box = (x, y, x + min(self.tileLength, self.width - max(x, sx)),
+               y + min(self.tileLength, self.height - max(y, sy)))
+        self._copy(self.background, box, self.width, x - sx, y - sy)
+        if name != None:
+            width, height, data = tile
+            tx = x + self.tileLength//2 - width//2
+            ty = y + self.tileLength//2 - height//2
+            clip = (max(tx, x), max(ty, y),
+                    min(tx + width, box[2]), min(ty + height, box[3]))
+            if clip[0] < clip[2] and clip[1] < clip[3]:
+                self._copy(data, clip, width, tx, ty)
+        self.tiles[cell] = name
+        self.stale.add(cell)
+
+    def _copy(self, data, box, width, x, y):
+        # copy the rows of box from data, an image width pixels wide
+        # whose top left corner is at (x,y) in the layer
+        x0, y0, x1, y1 = box
+        if x0 >= x1: return
+        row = (x1 - x0) * 3
+        for line in range(y0, y1):
+            start = ((line - y) * width + x0 - x) * 3
+            end = (line * self.width + x0) * 3
+            self.pixels[end:end + row] = data[start:start + row]
+
+    def scroll(self, origin):
+        """ Show the room from origin on. Painted cells that stay in view
+            are moved along; the cells scrolled into view are not painted. """
+        dx = origin[0] - self.origin[0]
+        dy = origin[1] - self.origin[1]
+        if dx == 0 and dy == 0:
+            return
+        self.origin = origin
+        tiles = {}
+        for (x,y), name in self.tiles.items():
+            if 0 <= x - dx < self.view and 0 <= y - dy < self.view:
+                tiles[(x - dx, y - dy)] = name
+        self.tiles = tiles
+        if tiles: # move the pixels of the cells that stay
+            x0, y0 = self._corner((max(-dx, 0), max(-dy, 0)))
+            x1, y1 = self._corner((self.view - max(dx, 0), self.view - max(dy, 0)))
+            x1 = min(x1, self.width, self.width - dx*self.tileLength)
+            y1 = min(y1, self.height, self.height - dy*self.tileLength)
+            old = bytes(self.pixels)
+            self._copy(old, (x0, y0, x1, y1), self.width,
+                       -dx*self.tileLength, -dy*self.tileLength)
+        self.stale.clear()
+        self.redraw = True
+
+    def flush(self, cells=None):
+        """ Write the painted pixels of cells (by default all cells) to
+            the image """
+        if cells == None:
+            cells = list(self.stale)
+        if self.redraw or len(cells) > self.FULL:
+            self.image.setPixels(self.pixels)
+            self.redraw = False
+            self.stale.clear()
+            return
+        for cell in cells:
+            if cell not in self.stale:
+                continue
+            self.stale.discard(cell)
+            x0, y0 = self._corner(cell)
+            x1 = min(x0 + self.tileLength, self.width)
+            y1 = min(y0 + self.tileLength, self.height)
+            rows = []
+            for line in range(y0, y1):
+                start = (line * self.width + x0) * 3
+                rows.append(self.pixels[start:start + (x1 - x0) * 3])
+            self.image.setPixels(b"".join(rows), x0, y0, x1 - x0)
 
 class GameBoard:
     """ A game board of size X size squares with fields for tasks and inventory,
-        and many buttons. """
+        and many buttons. Rooms larger than VIEW X VIEW squares scroll to
+        follow the rover. """
+
+    MAX_INPUTS = 64 # actions that may wait to be run before new ones are dropped
+    VIEW = 15        # cells shown per side of the map; bigger rooms scroll
+    ROOM_LAYERS = 8  # composited rooms kept for when the rover comes back
+    FOLD_DELAY = 250 # ms without changes before overlays are folded into the room layer
+    READY_COLOR = 'ForestGreen' # marks a task that can be performed now
 
     # draw the board
     def __init__(self, title, game, size, bkColor='FireBrick', buttonColor='Gold'):
@@ -48,10 +246,17 @@ class GameBoard:
         """
         width = 650
         height = 600
-        self.size = size
+        self.size = size # cells per side of a room
+        self.view = min(size, self.VIEW)
 
         self.game = game 
         self.window = GraphWin(title, width, height)
+
+        # cut the tiles out of one packed texture instead of loading each file
+        self.atlas = None
+        if hasattr(self.game, 'getTileImages'):
+            self.atlas = TextureAtlas(self.game.getTileImages())
+            useAtlas(self.atlas)
         self.window.setBackground(bkColor)
 
         sideOffset = 10  # offset from sides
@@ -59,7 +264,7 @@ class GameBoard:
         boxOffset = 5    # offset from side of box
         taskHeight = 100 # height of task window where tasks are listed
         taskWidth = 400
-        self.mapSize = (400//self.size)*self.size  # height of map window where map is seen
+        self.mapSize = (400//self.view)*self.view  # height of map window where map is seen
         invHeight = 300 # height of inv window where inventory is listed
         invWidth = 200
         buttonWidth = 200 # width of the button space
@@ -132,124 +337,386 @@ class GameBoard:
                            "Quit", self.quit, buttonColor)
         self.quit.draw(self.window)
         self.help = Button(Point(buttonX + buttonWidth*3/4, buttonY + lineSpace*8),
-                           "Help", self.nothing, buttonColor)
+                           "Help", self.toggleStats, buttonColor)
         self.help.draw(self.window)
 
-        self.images = []
-        for x in range(self.size):
-            self.images.append([])
-            for y in range(self.size):
-                self.images[x].append(None)
+        # the arrow keys work like the arrow buttons
+        self.window.setKeyHandler('Up', partial(self.do, self.game.goUp))
+        self.window.setKeyHandler('Down', partial(self.do, self.game.goDown))
+        self.window.setKeyHandler('Left', partial(self.do, self.game.goLeft))
+        self.window.setKeyHandler('Right', partial(self.do, self.game.goRight))
 
+        # The tiles of a room are painted into one image, its layer.
+        # Changed cells are drawn as overlays on top of the layer until
+        # the window has been idle for FOLD_DELAY ms, then folded in.
+        self.background = self.mapRect.getPixels()
+        self.tilePixels = {}         # image name -> (width, height, RGB bytes)
+        # the room on screen: the game's first room, then as sent by the game
+        self.room = getattr(getattr(game, 'map', None), 'id', None)
+        self.layers = OrderedDict()  # room -> RoomLayer, most recently shown last
+        self.layer = None            # the layer on screen
+        self.overlays = {}           # (x,y) -> Image drawn over the layer
+        self.foldScheduled = False
+        self.overlaysDrawn = 0       # overlays drawn so far, to tell if more came
+
+        self.rover = None # the rover sprite, moved around the map
+        self.marks = {}   # (x,y) -> Rectangle around a cell where the task can be done
+        self.taskReady = False
+
+        # frame timings, shown over the map by the help button
+        self.stats = FrameStats()
+        self.tilesTouched = 0
+        self.statsBox = Rectangle(Point(self.mapRectX, self.mapRectY),
+                                  Point(self.mapRectX + 240, self.mapRectY + 70))
+        self.statsBox.setFill("white")
+        self.statsText = Text(Point(self.mapRectX + boxOffset, self.mapRectY + boxOffset), " ")
+        self.showStats = False
         self.isUpdating = False # to handle overlapping calls to updateGUI()
 
+        # Actions wait in a queue until Tk is idle. Everything queued by
+        # then is run in order and followed by one updateGUI().
+        self.inputs = deque()
+        self.drainScheduled = False
+        self.inputStats = {'received': 0, 'coalesced': 0, 'dropped': 0, 'updates': 0}
+
+        # Games that publish their changes let us redraw only what changed.
+        # Other games are polled in full on every update.
+        self.dirty = set()      # (x,y) of cells to redraw
+        self.changed = set()    # names of the other things that changed
+        self.fullRepaint = True # redraw everything on the next update
+        self.listening = hasattr(self.game, 'addListener')
+        if self.listening:
+            self.game.addListener(self.onGameChange)
+
     def do(self, fncn):
-        """ Wrapper class that runs the provided function and then
-            updates the GUI. """
-        if self.isUpdating:
+        """ Wrapper class that queues the provided function. Queued functions
+            are run once Tk is idle and then the GUI is updated. Actions are
+            only dropped if more than MAX_INPUTS are waiting. """
+        self.inputStats['received'] += 1
+        if len(self.inputs) >= self.MAX_INPUTS:
+            self.inputStats['dropped'] += 1
+            return
+        self.inputs.append(fncn)
+        if not self.drainScheduled:
+            self.drainScheduled = True
+            self.window.after_idle(self.runInputs)
+
+    def runInputs(self):
+        """ Run every queued action in order, then update the GUI once.
+            A burst of moves therefore costs a single repaint. """
+        if self.isUpdating: # try again once the current update is done
+            self.window.after(10, self.runInputs)
+            return
+        self.drainScheduled = False
+        if self.window.isClosed():
+            self.inputs.clear()
             return
-        
-        fncn()
-        self.updateGUI()
+
+        count = 0
+        while self.inputs:
+            fncn = self.inputs.popleft()
+            fncn()
+            count += 1
+        if count > 0:
+            self.inputStats['coalesced'] += count - 1
+            self.inputStats['updates'] += 1
+            self.updateGUI()
+
+    def getInputStats(self):
+        """ Returns how many actions were received, how many were merged
+            into an update together with an earlier one, how many were
+            dropped because the queue was full and how many updates ran. """
+        return dict(self.inputStats)
+
+    def onGameChange(self, event, data=None):
+        """ Called by the game when its state changes. Remembers what has
+            to be redrawn by the next updateGUI(). """
+        if event == 'cell':
+            self.dirty.add(data)
+        elif event == 'room':
+            self.room = data
+            self.fullRepaint = True
+        self.changed.add(event)
 
     def updateGUI(self):
-        """ Update the GUI (tasks, inventory, grid) """
+        """ Update the GUI (tasks, inventory, grid). Everything is drawn
+            in one batch so the window is flushed once per update. """
         self.isUpdating = True
-        
-        tileLength = self.mapSize//self.size
-
-        # Update the stuff on the grid (items, portals, ship components)
-        for x in range(self.size):
-            for y in range(self.size):
-                image = self.game.getImage(Point(x,y))
-                               
-                # if image was in location and has changed or gone, erase it
-                if self.images[x][y] != None and self.images[x][y].getImage()!=image:
-                    self.images[x][y].undraw()
-                
-                # if image is now there and wasn't before
-                if image != None and self.images[x][y] == None:
-                    i = Image(Point(self.mapRectX + x*tileLength + tileLength//2,
-                                     self.mapRectY + y*tileLength + tileLength//2),
-                            tileLength,tileLength)
-                    i.setImage(image)
-                    i.draw(self.window)
-                    self.images[x][y] = i
-
-                # if image was there and has changed
-                elif image != None and self.images[x][y] != None and self.images[x][y].getImage()!=image:
-                    self.images[x][y].setImage(image)
-                    self.images[x][y].draw(self.window)
-                
-                # if now gone
-                elif image == None and self.images[x][y] != None:
-                    self.images[x][y] = None
-
-                # error checking.. nothing should print
-                elif image == None and self.images[x][y] == None:
-                    pass
-                elif self.images[x][y] != None and image == self.images[x][y].getImage():
-                    pass
-                else:
-                    string = '['+str(x)+']['+str(y)+'] image:' + str(image) + ', stored image:'
-                    if self.images[x][y] == None:
-                        string += 'None'
-                    else:
-                        string += self.images[x][y].getImage()
-                    print(string)
+        start = time.perf_counter()
+        loads = getTextureStats()['loads']
+        flushes = self.window.flushCount
+        self.tilesTouched = 0
+        with self.window.batch():
+            tileLength = self.mapSize//self.view
+            everything = self.fullRepaint or not self.listening
+
+            # Update the stuff on the grid (items, portals, ship components)
+            scrolled = False
+            if everything:
+                self.foldOverlays()
+                self.showRoom(tileLength)
+            else:
+                if 'rover' in self.changed and self.viewOrigin() != self.layer.origin:
+                    self.foldOverlays()
+                    self.scroll(tileLength)
+                    scrolled = True
+                for (x,y) in self.dirty:
+                    self.updateTile(x, y, tileLength)
                 
-        # Update the rover
-        rover = self.game.getRoverImage()
-        loc = self.game.getRoverLocation()
-        try: # decently non-flickery
-            self.rover.undraw()
-        except Exception:
-            pass
-        if loc != None and rover != None:
-            self.rover = Image(Point(self.mapRectX + loc.x*tileLength + tileLength//2,
-                                     self.mapRectY + loc.y*tileLength + tileLength//2),
-                               tileLength,tileLength)
-            self.rover.setImage(rover)
-            self.rover.draw(self.window)
+            # Outline the cells where the task can be performed
+            if everything or scrolled or 'ready' in self.changed or 'task' in self.changed:
+                self.updateMarks(tileLength)
+
+            # Update the rover (redrawn tiles would cover it)
+            if everything or 'rover' in self.changed or self.dirty:
+                self.updateRover(tileLength)
+
+            # Update the task field
+            if everything or 'task' in self.changed or 'ready' in self.changed:
+                taskText = self.game.getCurrentTask()
+                oldTaskText = self.taskWin.config["text"]
+                if taskText != None and taskText != oldTaskText:
+                    self.taskWin.setText(taskText)
+                ready = hasattr(self.game, 'isTaskReady') and self.game.isTaskReady()
+                if ready != self.taskReady:
+                    self.taskReady = ready
+                    self.taskWin.setTextColor(self.READY_COLOR if ready else 'black')
+
+            # Update the inventory field
+            if everything or 'inventory' in self.changed:
+                invText = self.game.getInventory()
+                oldInvText = self.invWin.config["text"]
+                if invText != None and invText != oldInvText:
+                    self.invWin.setText(invText)
 
-        # Update the task field
-        taskText = self.game.getCurrentTask()
-        oldTaskText = self.taskWin.config["text"]
-        if taskText != None and taskText != oldTaskText:
-            self.taskWin.undraw()
-            self.taskWin.config["text"] = taskText
-            self.taskWin.draw(self.window)
-
-        # Update the inventory field
-        invText = self.game.getInventory()
-        oldInvText = self.invWin.config["text"]
-        if invText != None and invText != oldInvText:
-            self.invWin.undraw()
-            self.invWin.config["text"] = invText
-            self.invWin.draw(self.window)
+            if self.showStats:
+                self.statsText.setText(str(self.stats))
+                self.statsBox.toFront()
+                self.statsText.toFront()
 
+        self.dirty.clear()
+        self.changed.clear()
+        self.fullRepaint = False
         self.isUpdating = False
+        self.stats.add((time.perf_counter() - start) * 1000, self.tilesTouched,
+                       getTextureStats()['loads'] - loads,
+                       self.window.flushCount - flushes)
+
+    def getTilePixels(self, name):
+        """ Returns (width, height, RGB bytes) of the image name """
+        tile = self.tilePixels.get(name)
+        if tile == None:
+            if self.atlas != None and self.atlas.has(name):
+                tile = self.atlas.getPixels(name)
+            else:
+                image = Image(Point(0,0), name)
+                tile = (image.getWidth(), image.getHeight(), image.getPixels())
+            self.tilePixels[name] = tile
+        return tile
+
+    def viewOrigin(self):
+        """ Returns the room cell (x,y) to show in the top left corner of
+            the map. The view keeps the rover in the middle until it
+            reaches the edges of the room. """
+        loc = self.game.getRoverLocation()
+        if loc == None or self.size <= self.view:
+            return (0,0)
+        most = self.size - self.view
+        return (min(max(loc.x - self.view//2, 0), most),
+                min(max(loc.y - self.view//2, 0), most))
+
+    def paintTile(self, x, y):
+        """ Paint the game's image of view cell (x,y) into the room layer.
+            Returns the image name, or False if it was painted already. """
+        ox, oy = self.layer.origin
+        image = self.game.getImage(GridPoint(ox + x, oy + y))
+        if self.layer.isPainted((x,y)) and image == self.layer.getTile((x,y)):
+            return False
+        self.tilesTouched += 1
+        tile = None
+        if image != None:
+            tile = self.getTilePixels(image)
+        self.layer.paint((x,y), image, tile)
+        return image
+
+    def showRoom(self, tileLength):
+        """ Bring the layer of the current room in line with the game and
+            put it on screen. Layers of rooms seen before are reused. """
+        layer = self.layers.pop(self.room, None)
+        if layer == None:
+            layer = RoomLayer(self.mapRect.getAnchor(), self.background,
+                              self.mapRect.getWidth(), self.mapRect.getHeight(),
+                              (self.mapRectX, self.mapRectY), tileLength, self.view)
+        self.layers[self.room] = layer
+        while len(self.layers) > self.ROOM_LAYERS:
+            self.layers.popitem(last=False)
+
+        # tiles of rooms off screen may have changed since they were shown
+        previous = self.layer
+        self.layer = layer
+        layer.scroll(self.viewOrigin())
+        for x in range(self.view):
+            for y in range(self.view):
+                self.paintTile(x, y)
+        layer.flush()
+
+        if layer is not previous:
+            if previous == None:
+                self.mapRect.undraw() # the layer has the map in it
+            else:
+                previous.image.undraw()
+            layer.image.draw(self.window)
+
+    def scroll(self, tileLength):
+        """ Scroll the map to follow the rover. The cells still in view are
+            moved; only the cells scrolled into view are painted. """
+        self.layer.scroll(self.viewOrigin())
+        for x in range(self.view):
+            for y in range(self.view):
+                if not self.layer.isPainted((x,y)):
+                    self.paintTile(x, y)
+        self.layer.flush()
+
+    def updateTile(self, x, y, tileLength):
+        """ Bring the image of room cell (x,y) in line with the game if it
+            is in view. A new tile is drawn as an overlay until
+            foldOverlays() writes it into the room layer; an emptied cell
+            is written straight away. """
+        x = x - self.layer.origin[0]
+        y = y - self.layer.origin[1]
+        if x < 0 or y < 0 or x >= self.view or y >= self.view:
+            return
+        image = self.paintTile(x, y)
+        if image == False:
+            return
+        overlay = self.overlays.pop((x,y), None)
+        if overlay != None:
+            overlay.undraw()
+        if image == None:
+            self.layer.flush([(x,y)])
+            return
+
+        overlay = Image(Point(self.mapRectX + x*tileLength + tileLength//2,
+                              self.mapRectY + y*tileLength + tileLength//2),
+                        image) # shared texture, decoded once
+        overlay.draw(self.window)
+        self.overlays[(x,y)] = overlay
+        self.overlaysDrawn += 1
+        if not self.foldScheduled:
+            self.foldScheduled = True
+            self.window.after(self.FOLD_DELAY, self.foldOverlays, self.overlaysDrawn)
+
+    def foldOverlays(self, drawn=None):
+        """ Write the cells drawn as overlays into the room layer and remove
+            the overlays. Scheduled with the number of overlays drawn so
+            far; waits another FOLD_DELAY ms if more were drawn since.
+            Called without it, folds at once. """
+        if drawn != None:
+            if self.isUpdating or self.inputs or drawn != self.overlaysDrawn:
+                self.window.after(self.FOLD_DELAY, self.foldOverlays, self.overlaysDrawn)
+                return
+            self.foldScheduled = False
+        if not self.overlays or self.window.isClosed():
+            return
+        with self.window.batch():
+            self.layer.flush(list(self.overlays))
+            for overlay in self.overlays.values():
+                overlay.undraw()
+            self.overlays.clear()
+
+    def updateMarks(self, tileLength):
+        """ Outline the cells in view where the current task can be
+            performed, as told by the game's getReadyCells(). """
+        cells = []
+        if hasattr(self.game, 'getReadyCells'):
+            ox, oy = self.layer.origin
+            for loc in self.game.getReadyCells():
+                x, y = loc.x - ox, loc.y - oy
+                if 0 <= x < self.view and 0 <= y < self.view:
+                    cells.append((x,y))
+        for cell in list(self.marks):
+            if cell not in cells:
+                self.marks.pop(cell).undraw()
+        for (x,y) in cells:
+            mark = self.marks.get((x,y))
+            if mark != None:
+                mark.toFront() # stay above tiles drawn after it
+                continue
+            mark = Rectangle(Point(self.mapRectX + x*tileLength + 1, self.mapRectY + y*tileLength + 1),
+                             Point(self.mapRectX + (x+1)*tileLength - 2, self.mapRectY + (y+1)*tileLength - 2))
+            mark.setOutline(self.READY_COLOR)
+            mark.setWidth(3)
+            mark.draw(self.window)
+            self.marks[(x,y)] = mark
+
+    def updateRover(self, tileLength):
+        """ Move the rover sprite to the rover's location. The sprite stays
+            on the canvas; its texture is only replaced when the rover's
+            image changes. """
+        rover = self.game.getRoverImage()
+        loc = self.game.getRoverLocation()
+        if loc == None or rover == None:
+            if self.rover != None:
+                self.rover.undraw()
+                self.rover = None
+            return
+
+        ox, oy = self.layer.origin
+        x = self.mapRectX + (loc.x - ox)*tileLength + tileLength//2
+        y = self.mapRectY + (loc.y - oy)*tileLength + tileLength//2
+        if self.rover == None:
+            self.rover = Image(Point(x, y), rover)
+            self.rover.draw(self.window)
+            return
+        if self.rover.getImage() != rover:
+            self.rover.setImage(rover)
+        anchor = self.rover.getAnchor()
+        if anchor.x != x or anchor.y != y:
+            self.rover.move(x - anchor.x, y - anchor.y)
+        self.rover.toFront() # stay above tiles drawn after it
         
-    def nothing(self):
-        """ Called by the help button. Could be replaced by a function
-            that actually does something. """
-        print('help button click')
+    def toggleStats(self):
+        """ Called by the help button. Shows or hides the frame timings
+            over the map. """
+        self.showStats = not self.showStats
+        if self.showStats:
+            self.statsText.setText(str(self.stats))
+            self.statsBox.draw(self.window)
+            self.statsText.draw(self.window)
+        else:
+            self.statsText.undraw()
+            self.statsBox.undraw()
+
+    def dumpStats(self, filename='frames.json'):
+        """ Write the frame timings to a JSON file for offline analysis """
+        self.stats.dump(filename)
 
-    def run(self):
-        """ Repeatedly wait for a click.. Keeps the game running. """
+    def run(self, eventDriven=True):
+        """ Keeps the game running until the window is closed. Tk's event
+            loop calls the button handlers as soon as they are clicked and
+            sleeps while nothing happens. With eventDriven=False the old
+            loop that polls for a click is used instead. """
         self.updateGUI()
         self.shouldRun = True
 
-        while(self.shouldRun):
+        if eventDriven:
+            self.window.loop() # returns once quit() closes the window
+            self.shouldRun = False
+            return
+
+        while(self.shouldRun and self.window.isOpen()):
             try:
                 pt = self.window.getMouse()
             except Exception:
                 pass
 
     def quit(self):
-        """ Called by the quit button. Closes the window and forces the run
-            loop to terminate.
+        """ Called by the quit button. Closes the window, which ends the
+            event loop, and forces the polling run loop to terminate.
+            Games with a close() method are told they are done.
         """
         self.window.close()
         self.shouldRun = False
+        if hasattr(self.game, 'close'):
+            self.game.close()
    
@@ -61,6 +61,32 @@ Programming: An Introduction to Computer Science" by John Zelle,
 published by Franklin, Beedle & Associates.  Also see
 http://mcsp.wartburg.edu/zelle/python for a quick reference"""
 
+# Version 4.3
+#     * Added TextureCache. Images loaded from a file share one decoded
+#         PhotoImage per file name instead of decoding it on every use.
+#     * Added GraphWin.batch (and beginBatch/commitBatch). Changes made in
+#         a batch are flushed once at the end instead of after each call.
+#     * Added GraphWin.loop to run Tk's event loop until the window closes
+#         instead of polling with getMouse.
+#     * Added RecordingBackend and setBackend. GraphWin now wraps the
+#         backend's canvas instead of subclassing tk.Canvas, so windows
+#         can be drawn without Tk (and without a display).
+#     * Added Image.getPixels/setPixels (and getArray/setArray with NumPy)
+#         to read and write whole regions of an image in one call.
+#     * Added readPPM/writePPM. PPM files are memory mapped, checked and
+#         given to Tk as data; Image.save writes PPM files directly.
+#     * Added TextureAtlas. Small images can be packed into one texture
+#         and cut out of it by the texture cache (see useAtlas).
+#     * tkinter is imported when it is first used, not by importing this
+#         module, and no longer prints "Importing mtTkinter". The hidden
+#         root window is made with the first window or image. Importing
+#         graphics (and a game built on it) should take a few milliseconds;
+#         about 10 ms when measured with python -X importtime.
+#     * Added Transform.screenMany/worldMany (GraphWin.toScreenMany and
+#         toWorldMany) to convert many coordinates in one call, with NumPy
+#         for long lists when it is installed. Polygon and Line use them.
+#     * Added GridPoint, an immutable, hashable (x, y) for positions that
+#         are not drawn. toPoint() makes the drawable Point.
 # Version 4.2 5/26/2011
 #     * Modified Image to allow multiple undraws like other GraphicsObjects
 # Version 4.1 12/29/2009
@@ -151,14 +177,28 @@ http://mcsp.wartburg.edu/zelle/python for a quick reference"""
 #     Added anchor to options. Default is center
 #     Button should really be using the tk Button but it doesnt
 
-import time, os, sys
+import time, os, sys, heapq, mmap
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 
-print("Importing mtTkinter")
-# Thread-safe version of tkinter
-try:  # import as appropriate for 2.x vs. 3.x
-   import tkinter as tk
-except:
-   import mtTkinter as tk
+class _LazyTk:
+
+    """Stands in for the tkinter module. tkinter is imported the first
+    time one of its names is used, so importing graphics stays cheap and
+    works without a display."""
+
+    _module = None
+
+    def __getattr__(self, name):
+        if _LazyTk._module is None:
+            try:  # import as appropriate for 2.x vs. 3.x
+                import tkinter as module
+            except ImportError: # Thread-safe version of tkinter
+                import mtTkinter as module
+            _LazyTk._module = module
+        return getattr(_LazyTk._module, name)
+
+tk = _LazyTk()
 
 
 ##########################################################################
@@ -173,24 +213,624 @@ UNSUPPORTED_METHOD = "Object doesn't support operation"
 BAD_OPTION = "Illegal option value"
 DEAD_THREAD = "Graphics thread quit unexpectedly"
 
-_root = tk.Tk()
-_root.withdraw()
+##########################################################################
+# PPM files
+
+class PPM:
+
+    """Pixels of a PPM image as 8 bit RGB bytes, row by row.
+
+    pixels is a memoryview. For a raw (P6) file with a maximum color
+    value of 255 it looks straight into the memory mapped file, so
+    nothing is copied until the pixels are used. Call close when done
+    with a PPM read from a file."""
+
+    def __init__(self, width, height, pixels, mapped=None):
+        self.width = width
+        self.height = height
+        self.pixels = memoryview(pixels)
+        self._mapped = mapped
+
+    def getHeader(self):
+        return b"P6\n%d %d\n255\n" % (self.width, self.height)
+
+    def toData(self):
+        """Returns the image as raw PPM data, e.g. for PhotoImage(data=...)"""
+        return self.getHeader() + self.pixels.tobytes()
+
+    def close(self):
+        """Unmap the file the pixels were read from"""
+        self.pixels.release()
+        if self._mapped is not None:
+            self._mapped.close()
+            self._mapped = None
+
+def _ppmHeader(data):
+    # Parse the header of PPM data. Returns the magic number, width,
+    # height, maximum color value and the offset of the pixel data.
+    fields = []
+    i = 0
+    n = len(data)
+    while len(fields) < 4:
+        while i < n and data[i] in b" \t\r\n":
+            i = i + 1
+        if i < n and data[i] == ord("#"): # comment up to the end of the line
+            while i < n and data[i] not in b"\r\n":
+                i = i + 1
+            continue
+        start = i
+        while i < n and data[i] not in b" \t\r\n#":
+            i = i + 1
+        if start == i or (not fields and data[start:i] not in (b"P3", b"P6")):
+            raise GraphicsError("not a PPM image")
+        fields.append(bytes(data[start:i]))
+    try:
+        width, height, maxval = int(fields[1]), int(fields[2]), int(fields[3])
+    except ValueError:
+        raise GraphicsError("bad PPM header")
+    if width <= 0 or height <= 0 or not 0 < maxval < 65536:
+        raise GraphicsError("bad PPM header")
+    return fields[0], width, height, maxval, i + 1
+
+def _decodePPM(data, mapped=None):
+    # Build a PPM from the bytes of a P6 or P3 image
+    magic, width, height, maxval, offset = _ppmHeader(data)
+    size = width * height * 3
+    if magic == b"P3":
+        values = bytes(data[offset-1:]).split()
+        if len(values) < size:
+            raise GraphicsError("PPM image is too short")
+        try:
+            values = [int(v) for v in values[:size]]
+        except ValueError:
+            raise GraphicsError("PPM image has a sample that is not a number")
+    elif maxval < 256:
+        if len(data) < offset + size:
+            raise GraphicsError("PPM image is too short")
+        if maxval == 255: # the pixels can be used as they are
+            return PPM(width, height, memoryview(data)[offset:offset+size], mapped)
+        values = data[offset:offset+size]
+    else: # two bytes per value, most significant first
+        if len(data) < offset + size*2:
+            raise GraphicsError("PPM image is too short")
+        raw = data[offset:offset+size*2]
+        values = [raw[i]*256 + raw[i+1] for i in range(0, size*2, 2)]
+    if values and (max(values) > maxval or min(values) < 0):
+        raise GraphicsError("PPM image has a sample outside 0 to maxval")
+    if maxval != 255:
+        values = [(v*255 + maxval//2) // maxval for v in values]
+    return PPM(width, height, bytearray(values))
+
+def readPPM(filename):
+    """Read a PPM image (raw P6 or plain P3). The file is memory mapped
+    rather than read, and the header is checked. Returns a PPM.
+    Raises GraphicsError if the file is not a valid PPM image."""
+    f = open(filename, 'rb')
+    try:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError: # empty file
+            raise GraphicsError("not a PPM image")
+    finally:
+        f.close()
+    try:
+        ppm = _decodePPM(mapped, mapped)
+    except GraphicsError:
+        mapped.close()
+        raise
+    if ppm._mapped is None: # pixels were converted, the map is not needed
+        mapped.close()
+    return ppm
+
+def writePPM(filename, width, height, pixels):
+    """Write RGB bytes (3 per pixel, row by row) as a raw PPM file"""
+    if len(pixels) != width * height * 3:
+        raise GraphicsError("pixel data does not match the image size")
+    f = open(filename, 'wb')
+    try:
+        f.write(b"P6\n%d %d\n255\n" % (width, height))
+        f.write(pixels)
+    finally:
+        f.close()
+
+##########################################################################
+# Backends
+#
+# Windows, widgets and photo images are made by the current backend.
+# The default backend is tkinter itself. The recording backend below
+# provides the same classes without opening any windows.
+
+_backend = tk
+_root = None # created with the first window (or image) that needs it
+
+def _getRoot():
+    global _root
+    if _root is None:
+        _root = _backend.Tk()
+        _root.withdraw()
+    return _root
 
 def update():
-    _root.update()
+    _getRoot().update()
+
+def setBackend(backend):
+    """Choose what windows are drawn with. backend is 'tk' (the
+    default), 'recording' for a RecordingBackend, or a backend object.
+    Must be called before the first window or image is created.
+    Returns the backend in use."""
+    global _backend
+    if _root is not None:
+        raise GraphicsError("backend must be set before the first window is created")
+    if backend == 'tk':
+        backend = tk
+    elif backend == 'recording':
+        backend = RecordingBackend()
+    _backend = backend
+    return backend
+
+def getTextureStats():
+    """Return a dictionary describing the shared texture cache: files
+    loaded (decoded), cache hits, textures cached and their size."""
+    return {'loads': _textures.loads, 'hits': _textures.hits,
+            'textures': len(_textures.textures), 'bytes': _textures.size}
+
+def getBackend():
+    """Return the backend in use"""
+    return _backend
+
+class _RecordingWidget:
+
+    """Base class of the recording backend's widgets. Widgets keep
+    their options, and pass timer and update calls on to the root."""
+
+    def __init__(self, master=None, cnf={}, **options):
+        if master is None:
+            master = _getRoot()
+        self.master = master
+        self.root = master.root
+        self.backend = master.backend
+        self.options = dict(cnf)
+        self.options.update(options)
+        self.bindings = {}
+        self.destroyed = False
+
+    def pack(self, *args, **options): pass
+
+    def configure(self, cnf={}, **options):
+        self.options.update(cnf)
+        self.options.update(options)
+        self.backend.record('configure', self.__class__.__name__, dict(cnf, **options))
+
+    config = configure
+
+    def cget(self, option):
+        return self.options.get(option)
+
+    def bind(self, sequence, func=None, add=None):
+        self.bindings[sequence] = func
+
+    def destroy(self):
+        self.destroyed = True
+        self.backend.record('destroy', self.__class__.__name__)
+
+    def after(self, ms, func=None, *args):
+        return self.root.after(ms, func, *args)
+
+    def after_idle(self, func, *args):
+        return self.root.after_idle(func, *args)
+
+    def after_cancel(self, id):
+        self.root.after_cancel(id)
+
+    def update(self):
+        self.root.update()
+
+    def update_idletasks(self):
+        self.root.update_idletasks()
+
+    def mainloop(self, n=0):
+        self.root.mainloop(n)
+
+    def quit(self):
+        self.root.quit()
+
+class _RecordingRoot(_RecordingWidget):
+
+    """Hidden root of the recording backend. Runs scheduled callbacks
+    on a simulated clock, so timers never make a headless run sleep."""
+
+    def __init__(self):
+        self.master = None
+        self.root = self
+        self.backend = _backend
+        self.options = {}
+        self.bindings = {}
+        self.destroyed = False
+        self.clock = 0 # simulated time in ms
+        self._count = 0
+        self._idle = []
+        self._timers = [] # heap of (time, count, func, args)
+        self._cancelled = set()
+        self._quit = False
+
+    def withdraw(self): pass
+
+    def after(self, ms, func=None, *args):
+        self._count = self._count + 1
+        heapq.heappush(self._timers, (self.clock + ms, self._count, func, args))
+        return "after#%d" % self._count
+
+    def after_idle(self, func, *args):
+        self._count = self._count + 1
+        self._idle.append((self._count, func, args))
+        return "after#%d" % self._count
+
+    def after_cancel(self, id):
+        self._cancelled.add(int(id.split("#")[1]))
+
+    def _runIdle(self):
+        while self._idle:
+            idle = self._idle
+            self._idle = []
+            for count, func, args in idle:
+                if count not in self._cancelled:
+                    func(*args)
+
+    def _runTimers(self):
+        while self._timers and self._timers[0][0] <= self.clock:
+            time, count, func, args = heapq.heappop(self._timers)
+            if count not in self._cancelled:
+                func(*args)
+
+    def update(self):
+        self.backend.record('update')
+        self._runTimers()
+        self._runIdle()
+
+    def update_idletasks(self):
+        self.backend.record('update_idletasks')
+        self._runIdle()
+
+    def mainloop(self, n=0):
+        """Run callbacks until quit is called or nothing is scheduled.
+        Timers fire in order, moving the clock straight to each one."""
+        self._quit = False
+        while not self._quit:
+            self._runIdle()
+            if self._quit or not self._timers: break
+            self.clock = max(self.clock, self._timers[0][0])
+            self._runTimers()
+
+    def quit(self):
+        self._quit = True
+
+class _RecordingToplevel(_RecordingWidget):
+
+    def title(self, title):
+        self.options['title'] = title
+
+    def protocol(self, name, func):
+        self.bindings[name] = func
+
+    def resizable(self, width, height): pass
+
+    def lift(self): pass
+
+    def key(self, key):
+        """Act as if key (a Tk key name like 'Up') was pressed"""
+        func = self.bindings.get("<%s>" % key)
+        if func: func(_RecordingEvent())
+
+class _RecordingEvent:
+
+    def __init__(self, x=0, y=0):
+        self.x = x
+        self.y = y
+
+class _RecordingCanvas(_RecordingWidget):
+
+    """Canvas of the recording backend. Items are kept in a dictionary
+    (in stacking order) of id -> [type, coordinates, options]."""
+
+    def __init__(self, master=None, cnf={}, **options):
+        _RecordingWidget.__init__(self, master, cnf, **options)
+        self.items = {}
+        self._nextId = 1
+
+    def _create(self, kind, args, options):
+        coords = []
+        for arg in args:
+            if type(arg) == dict:
+                options = dict(arg, **options)
+            else:
+                coords.append(arg)
+        id = self._nextId
+        self._nextId = id + 1
+        self.items[id] = [kind, coords, dict(options)]
+        self.backend.record('create', id, kind)
+        return id
+
+    def create_line(self, *args, **options):
+        return self._create('line', args, options)
+
+    def create_rectangle(self, *args, **options):
+        return self._create('rectangle', args, options)
+
+    def create_oval(self, *args, **options):
+        return self._create('oval', args, options)
+
+    def create_polygon(self, *args, **options):
+        return self._create('polygon', args, options)
+
+    def create_text(self, *args, **options):
+        return self._create('text', args, options)
+
+    def create_image(self, *args, **options):
+        return self._create('image', args, options)
+
+    def create_window(self, *args, **options):
+        return self._create('window', args, options)
+
+    def delete(self, *ids):
+        for id in ids:
+            if id == 'all':
+                self.items.clear()
+            else:
+                self.items.pop(id, None)
+            self.backend.record('delete', id)
+
+    def move(self, id, dx, dy):
+        item = self.items.get(id)
+        if item is None: return
+        coords = item[1]
+        for i in range(0, len(coords)-1, 2):
+            coords[i] = coords[i] + dx
+            coords[i+1] = coords[i+1] + dy
+        self.backend.record('move', id, (dx,dy))
+
+    def coords(self, id, *coords):
+        item = self.items.get(id)
+        if item is None: return []
+        if coords:
+            if len(coords) == 1: coords = coords[0]
+            item[1] = list(coords)
+            self.backend.record('coords', id, tuple(coords))
+        return list(item[1])
+
+    def itemconfigure(self, id, cnf=None, **options):
+        item = self.items.get(id)
+        if item is None: return
+        if cnf:
+            item[2].update(cnf)
+        item[2].update(options)
+        self.backend.record('itemconfigure', id, dict(cnf or {}, **options))
+
+    itemconfig = itemconfigure
+
+    def itemcget(self, id, option):
+        return self.items[id][2].get(option)
+
+    def type(self, id):
+        item = self.items.get(id)
+        return item and item[0]
+
+    def tag_raise(self, id, above=None):
+        item = self.items.pop(id, None)
+        if item is None: return
+        self.items[id] = item
+        self.backend.record('raise', id)
+
+    def find_all(self):
+        return tuple(self.items)
+
+    def bbox(self, id):
+        kind, coords, options = self.items[id]
+        xs = coords[0::2]
+        ys = coords[1::2]
+        if kind == 'text': # rough size of the text in the default font
+            lines = str(options.get('text', '')).split('\n')
+            width = 7 * max(len(line) for line in lines)
+            return (xs[0], ys[0], xs[0] + width, ys[0] + 15 * len(lines))
+        return (min(xs), min(ys), max(xs), max(ys))
+
+    def click(self, x, y):
+        """Act as if the canvas was clicked at (x,y)"""
+        func = self.bindings.get("<Button-1>")
+        if func: func(_RecordingEvent(x, y))
+
+class _RecordingButton(_RecordingWidget):
+
+    def invoke(self):
+        """Act as if the button was clicked"""
+        command = self.options.get('command')
+        if command: return command()
+
+class _RecordingScale(_RecordingWidget):
+
+    def set(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+class _RecordingVar:
+
+    def __init__(self, master=None, value=""):
+        self.value = value
+
+    def set(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+class _RecordingPhoto:
+
+    """PhotoImage of the recording backend. Pixels are kept as RGB bytes.
+    Only PPM files and data can be read or written."""
+
+    _count = 0
+
+    def __init__(self, name=None, cnf={}, master=None, **options):
+        if master is None:
+            master = _getRoot()
+        self.backend = master.backend
+        options = dict(cnf, **options)
+        _RecordingPhoto._count = _RecordingPhoto._count + 1
+        self.name = name or "photo%d" % _RecordingPhoto._count
+        self._width = int(options.get('width', 0))
+        self._height = int(options.get('height', 0))
+        self.pixels = bytearray(self._width * self._height * 3)
+        if 'file' in options:
+            ppm = readPPM(options['file'])
+            self._width = ppm.width
+            self._height = ppm.height
+            self.pixels = bytearray(ppm.pixels)
+            ppm.close()
+            self.backend.record('photo', self.name, options['file'])
+        elif 'data' in options:
+            self._read(options['data'])
+            self.backend.record('photo', self.name, 'data')
+
+    def __str__(self):
+        return self.name
+
+    def _read(self, data):
+        if type(data) == str:
+            data = data.encode('latin-1')
+        ppm = _decodePPM(data)
+        self._width = ppm.width
+        self._height = ppm.height
+        self.pixels = bytearray(ppm.pixels)
+
+    def width(self):
+        return self._width
+
+    def height(self):
+        return self._height
+
+    def readRGB(self, x, y, width, height):
+        rows = []
+        for row in range(y, y + height):
+            i = (row*self._width + x) * 3
+            rows.append(self.pixels[i:i + width*3])
+        return bytearray(b"".join(rows))
+
+    def writeRGB(self, data, x, y, width, height):
+        for row in range(height):
+            i = ((y+row)*self._width + x) * 3
+            self.pixels[i:i + width*3] = data[row*width*3:(row+1)*width*3]
+        self.backend.record('photo_put', self.name)
+
+    def get(self, x, y):
+        i = (y*self._width + x) * 3
+        return tuple(self.pixels[i:i+3])
+
+    def put(self, data, to=None):
+        """Supports the forms used by Image: a color or a list of rows
+        of '#rrggbb' colors, in braces, placed at to=(x,y)."""
+        x0, y0 = 0, 0
+        if to:
+            x0, y0 = to[0], to[1]
+        if '{' in data:
+            rows = [row.split() for row in data.replace('}', '').split('{') if row.strip()]
+        else:
+            rows = [data.split()]
+        for dy in range(len(rows)):
+            for dx in range(len(rows[dy])):
+                color = rows[dy][dx]
+                if color.startswith('#') and len(color) == 7:
+                    rgb = bytes.fromhex(color[1:])
+                else:
+                    rgb = b'\0\0\0'
+                i = ((y0+dy)*self._width + x0 + dx) * 3
+                self.pixels[i:i+3] = rgb
+        self.backend.record('photo_put', self.name)
+
+    def copy(self):
+        other = _RecordingPhoto(master=_getRoot())
+        other._width = self._width
+        other._height = self._height
+        other.pixels = bytearray(self.pixels)
+        return other
+
+    def blank(self):
+        self.pixels = bytearray(len(self.pixels))
+
+    def write(self, filename, format=None, from_coords=None):
+        if format not in (None, 'ppm', 'PPM'):
+            raise GraphicsError("recording backend can only write PPM images")
+        writePPM(filename, self._width, self._height, self.pixels)
+
+class RecordingBackend:
+
+    """Stand-in for tkinter that never opens a window.
+
+    Windows made with this backend keep their items in memory and log
+    every drawing operation (create, delete, move, coords, configure,
+    raise, update) instead of calling Tk, so a game can be run and
+    timed on a machine without a display. Select it with
+    setBackend('recording') before the first window is created, or by
+    setting the environment variable GRAPHICS_BACKEND=recording.
+
+    log holds (operation, ...) tuples, at most logLimit of them (None
+    keeps all). counts holds how often each operation was done."""
+
+    Tk = _RecordingRoot
+    Toplevel = _RecordingToplevel
+    Canvas = _RecordingCanvas
+    Frame = _RecordingWidget
+    Button = _RecordingButton
+    Entry = _RecordingWidget
+    Scale = _RecordingScale
+    StringVar = _RecordingVar
+    PhotoImage = _RecordingPhoto
+
+    def __init__(self, logLimit=None):
+        self.log = deque(maxlen=logLimit)
+        self.counts = {}
+
+    def record(self, operation, *details):
+        self.counts[operation] = self.counts.get(operation, 0) + 1
+        self.log.append((operation,) + details)
+
+    def clear(self):
+        """Forget the log and the counts"""
+        self.log.clear()
+        self.counts = {}
+
+if os.environ.get('GRAPHICS_BACKEND') == 'recording':
+    _backend = RecordingBackend()
+
+def setTextureLimit(limit):
+    """Set the number of bytes of decoded textures kept by the shared
+    texture cache. Unused textures beyond the limit are evicted least
+    recently used first."""
+    _textures.setLimit(limit)
+
+def useAtlas(atlas):
+    """Let the shared texture cache cut images that are in atlas (a
+    TextureAtlas) out of it instead of loading their files. None stops
+    using an atlas."""
+    _textures.atlas = atlas
 
 ############################################################################
 # Graphics classes start here
         
-class GraphWin(tk.Canvas):
+class GraphWin:
+
+    """A GraphWin is a toplevel window for displaying graphics.
 
-    """A GraphWin is a toplevel window for displaying graphics."""
+    The drawing is done by a canvas widget of the current backend. Canvas
+    methods that GraphWin does not define itself (create_line, delete,
+    bind, after, ...) are passed on to that widget."""
 
     def __init__(self, title="Graphics Window",
                  width=200, height=200, autoflush=True):
-        master = tk.Toplevel(_root)
+        root = _getRoot()
+        master = _backend.Toplevel(root)
         master.protocol("WM_DELETE_WINDOW", self.close)
-        tk.Canvas.__init__(self, master, width=width, height=height)
+        self.widget = _backend.Canvas(master, width=width, height=height)
         self.master.title(title)
         self.pack()
         master.resizable(0,0)
@@ -205,8 +845,19 @@ class GraphWin(tk.Canvas):
         self._mouseCallback = None
         self.trans = None
         self.closed = False
+        self._batchDepth = 0
+        self._pending = {} # item id -> options to configure at commit
+        self._looping = False
+        self.flushCount = 0 # times the window was updated
         master.lift()
         if autoflush: _root.update()
+
+    def __getattr__(self, name):
+        # only called for attributes GraphWin does not have itself
+        widget = self.__dict__.get('widget')
+        if widget is None:
+            raise AttributeError(name)
+        return getattr(widget, name)
      
     def __checkOpen(self):
         if self.closed:
@@ -216,7 +867,7 @@ class GraphWin(tk.Canvas):
         """Set background color of the window"""
         self.__checkOpen()
         self.config(bg=color)
-        self.__autoflush()
+        self._autoflush()
         
     def setCoords(self, x1, y1, x2, y2):
         """Set coordinates of window to run from (x1,y1) in the
@@ -229,7 +880,9 @@ class GraphWin(tk.Canvas):
         if self.closed: return
         self.closed = True
         self.master.destroy()
-        self.__autoflush()
+        if self._looping:
+            _root.quit() # return from loop()
+        self._autoflush()
 
 
     def isClosed(self):
@@ -240,30 +893,99 @@ class GraphWin(tk.Canvas):
         return not self.closed
 
 
-    def __autoflush(self):
+    def _autoflush(self):
+        # Called after each change to the window
         if self.autoflush:
+            self.flushCount = self.flushCount + 1
             _root.update()
 
+    def beginBatch(self):
+        """Start a batch of drawing operations. Nothing is flushed to
+        the screen until the matching commitBatch. Batches may be
+        nested; only the outermost commit flushes."""
+        if self._batchDepth == 0:
+            self._batchAutoflush = self.autoflush
+            self.autoflush = False
+        self._batchDepth = self._batchDepth + 1
+
+    def commitBatch(self):
+        """End a batch. The outermost commit applies the configuration
+        changes made during the batch, one per item, and then updates
+        the window once."""
+        if self._batchDepth == 0: return
+        self._batchDepth = self._batchDepth - 1
+        if self._batchDepth > 0: return
+        self.autoflush = self._batchAutoflush
+        pending = self._pending
+        self._pending = {}
+        if self.closed: return
+        for id, options in pending.items():
+            self.itemconfig(id, options)
+        self.flushCount = self.flushCount + 1
+        self.update_idletasks()
+
+    @contextmanager
+    def batch(self):
+        """Context manager running beginBatch and commitBatch around
+        a block of drawing code:
+            with win.batch():
+                ... draw, move and configure objects ..."""
+        self.beginBatch()
+        try:
+            yield self
+        finally:
+            self.commitBatch()
+
+    def isBatching(self):
+        return self._batchDepth > 0
+
+    def _configure(self, id, options):
+        # Configure a canvas item now, or at commit time in a batch.
+        # Repeated changes to one item in a batch become one call.
+        if self._batchDepth > 0:
+            if id in self._pending:
+                self._pending[id].update(options)
+            else:
+                self._pending[id] = dict(options)
+        else:
+            self.itemconfig(id, options)
+
+    def _forget(self, id):
+        # Drop configuration changes pending for a deleted item
+        self._pending.pop(id, None)
+
     
     def plot(self, x, y, color="black"):
         """Set pixel (x,y) to the given color"""
         self.__checkOpen()
         xs,ys = self.toScreen(x,y)
         self.create_line(xs,ys,xs+1,ys, fill=color)
-        self.__autoflush()
+        self._autoflush()
         
     def plotPixel(self, x, y, color="black"):
         """Set pixel raw (independent of window coordinates) pixel
         (x,y) to color"""
         self.__checkOpen()
         self.create_line(x,y,x+1,y, fill=color)
-        self.__autoflush()
+        self._autoflush()
       
     def flush(self):
         """Update drawing to the window"""
         self.__checkOpen()
+        self.flushCount = self.flushCount + 1
         self.update_idletasks()
         
+    def loop(self):
+        """Handle events (clicks, button presses, timers set with after)
+        until the window is closed. The program sleeps inside Tk while
+        there is nothing to do."""
+        self.__checkOpen()
+        self._looping = True
+        try:
+            _root.mainloop()
+        finally:
+            self._looping = False
+
     def getMouse(self,DEBUG=False):
         """Wait for mouse click and return Point object representing
         the click"""
@@ -318,9 +1040,28 @@ class GraphWin(tk.Canvas):
             return self.trans.world(x,y)
         else:
             return x,y
+
+    def toScreenMany(self, coords):
+        """Returns a list with the screen coordinates of coords, a flat
+        sequence x0,y0,x1,y1,... of world coordinates"""
+        if self.trans:
+            return self.trans.screenMany(coords)
+        return list(coords)
+
+    def toWorldMany(self, coords):
+        """Returns a list with the world coordinates of coords, a flat
+        sequence x0,y0,x1,y1,... of screen coordinates"""
+        if self.trans:
+            return self.trans.worldMany(coords)
+        return list(coords)
         
     def setMouseHandler(self, func):
         self._mouseCallback = func
+
+    def setKeyHandler(self, key, func):
+        """Call func() whenever key is pressed while the window has the
+        focus. key is a Tk key name such as 'Up', 'Left' or 'space'."""
+        self.master.bind("<%s>" % key, lambda e: func())
         
     def _onClick(self, e):
         self.mouseX = e.x
@@ -355,6 +1096,52 @@ class Transform:
         y = self.ybase - ys*self.yscale
         return x,y
 
+    def screenMany(self, coords):
+        # Returns a list of screen coordinates for coords, a flat
+        # sequence x0,y0,x1,y1,... of world coordinates
+        numpy = _numpyFor(coords)
+        if numpy:
+            a = numpy.asarray(coords, dtype=float).reshape(-1, 2)
+            a = (a - (self.xbase, self.ybase)) / (self.xscale, -self.yscale)
+            return numpy.trunc(a + 0.5).astype(int).ravel().tolist()
+        xbase, ybase = self.xbase, self.ybase
+        xscale, yscale = self.xscale, self.yscale
+        result = list(coords)
+        result[0::2] = [int((x-xbase)/xscale + 0.5) for x in result[0::2]]
+        result[1::2] = [int((ybase-y)/yscale + 0.5) for y in result[1::2]]
+        return result
+
+    def worldMany(self, coords):
+        # Returns a list of world coordinates for coords, a flat
+        # sequence x0,y0,x1,y1,... of screen coordinates
+        numpy = _numpyFor(coords)
+        if numpy:
+            a = numpy.asarray(coords, dtype=float).reshape(-1, 2)
+            a = a * (self.xscale, -self.yscale) + (self.xbase, self.ybase)
+            return a.ravel().tolist()
+        xbase, ybase = self.xbase, self.ybase
+        xscale, yscale = self.xscale, self.yscale
+        result = list(coords)
+        result[0::2] = [x*xscale + xbase for x in result[0::2]]
+        result[1::2] = [ybase - y*yscale for y in result[1::2]]
+        return result
+
+_numpy = None # the numpy module once imported, False if it is not installed
+NUMPY_MIN = 64 # shorter coordinate lists are faster without numpy
+
+def _numpyFor(coords):
+    # Returns numpy if it is worth using for coords, else None
+    global _numpy
+    if len(coords) < NUMPY_MIN:
+        return None
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+    return _numpy or None
+
 
 # Default values for various item configuration options. Only a subset of
 #   keys may be present in the configuration dictionary for a given item
@@ -412,8 +1199,7 @@ class GraphicsObject:
         if graphwin.isClosed(): raise GraphicsError("Can't draw to closed window")
         self.canvas = graphwin
         self.id = self._draw(graphwin, self.config)
-        if graphwin.autoflush:
-            _root.update()
+        graphwin._autoflush()
 
             
     def undraw(self):
@@ -423,13 +1209,23 @@ class GraphicsObject:
         
         if not self.canvas: return
         if not self.canvas.isClosed():
+            self.canvas._forget(self.id)
             self.canvas.delete(self.id)
-            if self.canvas.autoflush:
-                _root.update()
+            self.canvas._autoflush()
         self.canvas = None
         self.id = None
 
 
+    def toFront(self):
+
+        """Raise the object above all other objects in its window.
+        Returns silently if the object is not currently drawn."""
+
+        canvas = self.canvas
+        if canvas and not canvas.isClosed():
+            canvas.tag_raise(self.id)
+            canvas._autoflush()
+
     def move(self, dx, dy):
 
         """move object dx units in x direction and dy units in y
@@ -446,8 +1242,7 @@ class GraphicsObject:
                 x = dx
                 y = dy
             self.canvas.move(self.id, x, y)
-            if canvas.autoflush:
-                _root.update()
+            canvas._autoflush()
            
     def _reconfig(self, option, setting):
         # Internal method for changing configuration of the object
@@ -458,9 +1253,8 @@ class GraphicsObject:
         options = self.config
         options[option] = setting
         if self.canvas and not self.canvas.isClosed():
-            self.canvas.itemconfig(self.id, options)
-            if self.canvas.autoflush:
-                _root.update()
+            self.canvas._configure(self.id, options)
+            self.canvas._autoflush()
 
 
     def _draw(self, canvas, options):
@@ -497,6 +1291,41 @@ class Point(GraphicsObject):
     def getX(self): return self.x
     def getY(self): return self.y
 
+class GridPoint(tuple):
+
+    """An immutable (x, y) position, such as a cell of a grid. Unlike a
+    Point it cannot be drawn, so it is cheap to make and can be used as
+    a dictionary key or set member. It is equal to the tuple (x, y).
+    toPoint() returns a Point to draw with."""
+
+    __slots__ = ()
+
+    def __new__(cls, x, y):
+        return tuple.__new__(cls, (x, y))
+
+    def __getnewargs__(self): # so pickle can make it again
+        return (self[0], self[1])
+
+    @property
+    def x(self): return self[0]
+
+    @property
+    def y(self): return self[1]
+
+    def getX(self): return self[0]
+    def getY(self): return self[1]
+
+    def moved(self, dx, dy):
+        """Returns the GridPoint dx, dy away from this one"""
+        return GridPoint(self[0] + dx, self[1] + dy)
+
+    def toPoint(self):
+        """Returns a Point at this position"""
+        return Point(self[0], self[1])
+
+    def __repr__(self):
+        return "GridPoint(%r, %r)" % (self[0], self[1])
+
 class _BBox(GraphicsObject):
     # Internal base class for objects represented by bounding box
     # (opposite corners) Line segment is a degenerate case.
@@ -590,8 +1419,7 @@ class Line(_BBox):
     def _draw(self, canvas, options):
         p1 = self.p1
         p2 = self.p2
-        x1,y1 = canvas.toScreen(p1.x,p1.y)
-        x2,y2 = canvas.toScreen(p2.x,p2.y)
+        x1,y1,x2,y2 = canvas.toScreenMany((p1.x,p1.y,p2.x,p2.y))
         return canvas.create_line(x1,y1,x2,y2,options)
         
     def setArrow(self, option):
@@ -622,13 +1450,13 @@ class Polygon(GraphicsObject):
             p.move(dx,dy)
    
     def _draw(self, canvas, options):
-        args = [canvas]
+        coords = []
         for p in self.points:
-            x,y = canvas.toScreen(p.x,p.y)
-            args.append(x)
-            args.append(y)
+            coords.append(p.x)
+            coords.append(p.y)
+        args = canvas.toScreenMany(coords)
         args.append(options)
-        return GraphWin.create_polygon(*args) 
+        return canvas.create_polygon(*args) 
 
 class Text(GraphicsObject):
     
@@ -701,8 +1529,8 @@ class Scale(GraphicsObject):
    def _draw(self, canvas, options):
       p = self.anchor
       x,y = canvas.toScreen(p.x,p.y)
-      frm = tk.Frame(canvas.master)
-      self.scale = tk.Scale(frm,
+      frm = _backend.Frame(canvas.master)
+      self.scale = _backend.Scale(frm,
                             from_=self.minVal, # min value on scale
                             to=self.maxVal, # max value on scale
                             orient='horizontal', # horiz or vert
@@ -730,8 +1558,8 @@ class Button(GraphicsObject):
     def _draw(self, canvas, options):
         p = self.anchor
         x,y = canvas.toScreen(p.x,p.y)
-        frm = tk.Frame(canvas.master)
-        self.button = tk.Button(frm,
+        frm = _backend.Frame(canvas.master)
+        self.button = _backend.Button(frm,
                                 command=self.fncn,
                                 text=self.text,
                                 background=self.bkcolor)
@@ -745,7 +1573,7 @@ class Entry(GraphicsObject):
         self.anchor = p.clone()
         #print self.anchor
         self.width = width
-        self.text = tk.StringVar(_root)
+        self.text = _backend.StringVar(_getRoot())
         self.text.set("")
         self.fill = "gray"
         self.color = "black"
@@ -755,8 +1583,8 @@ class Entry(GraphicsObject):
     def _draw(self, canvas, options):
         p = self.anchor
         x,y = canvas.toScreen(p.x,p.y)
-        frm = tk.Frame(canvas.master)
-        self.entry = tk.Entry(frm,
+        frm = _backend.Frame(canvas.master)
+        self.entry = _backend.Entry(frm,
                               width=self.width,
                               textvariable=self.text,
                               bg = self.fill,
@@ -778,7 +1606,7 @@ class Entry(GraphicsObject):
     def clone(self):
         other = Entry(self.anchor, self.width)
         other.config = self.config.copy()
-        other.text = tk.StringVar()
+        other.text = _backend.StringVar(_getRoot())
         other.text.set(self.text.get())
         other.fill = self.fill
         return other
@@ -824,6 +1652,258 @@ class Entry(GraphicsObject):
         if self.entry:
             self.entry.config(fg=color)
 
+_notHex = str.maketrans("", "", "{}#")
+
+def _colorText(data):
+    # Tk gives a tuple of rows (or a string when wantobjects is off)
+    if isinstance(data, (tuple, list)):
+        return " ".join([_colorText(row) for row in data])
+    return str(data)
+
+def _photoRead(photo, x, y, width, height):
+    # Read a region of a photo image as RGB bytes in one call
+    if hasattr(photo, 'readRGB'):
+        return photo.readRGB(x, y, width, height)
+    # Tk returns the region as rows of #rrggbb colors
+    data = photo.tk.call(photo.name, 'data', '-from', x, y, x + width, y + height)
+    return bytearray.fromhex(_colorText(data).translate(_notHex))
+
+def _photoWrite(photo, data, x, y, width, height):
+    # Write RGB bytes to a region of a photo image in one call
+    if hasattr(photo, 'writeRGB'):
+        photo.writeRGB(data, x, y, width, height)
+        return
+    ppm = b"P6\n%d %d\n255\n" % (width, height) + bytes(data)
+    try:
+        photo.tk.call(photo.name, 'put', ppm, '-format', 'ppm', '-to', x, y)
+    except tk.TclError: # Tk without PPM data support; send colors instead
+        hexdigits = bytes(data).hex()
+        rows = []
+        for row in range(height):
+            line = hexdigits[row*width*6:(row+1)*width*6]
+            rows.append("{" + " ".join(["#" + line[i:i+6] for i in range(0, len(line), 6)]) + "}")
+        photo.put(" ".join(rows), to=(x, y))
+
+def _photoCopy(dst, src, x, y, width, height):
+    # Copy a region of photo image src to the top left corner of dst
+    if hasattr(dst, 'writeRGB'):
+        dst.writeRGB(src.readRGB(x, y, width, height), 0, 0, width, height)
+    else:
+        dst.tk.call(dst.name, 'copy', src.name, '-from', x, y, x + width, y + height)
+
+class TextureAtlas:
+
+    """Many small images packed into one texture (a sprite sheet).
+
+    The images, given by file name, are read once and packed in rows
+    into a single photo image. view(name) cuts one of them out of the
+    sheet without touching its file again. Use the file names as keys:
+    after useAtlas(atlas) an Image of 'wrench.ppm' is made from the
+    atlas. Files that cannot be read are left out and listed in missing.
+    """
+
+    def __init__(self, names=(), sheetWidth=None):
+        self.regions = {} # name -> (x, y, width, height) in the sheet
+        self.missing = []
+        images = []
+        for name in names:
+            try:
+                ppm = readPPM(name)
+            except (GraphicsError, IOError, OSError):
+                self.missing.append(name)
+                continue
+            images.append((name, ppm))
+        if sheetWidth is None: # aim for a square sheet
+            area = sum([ppm.width * ppm.height for name, ppm in images])
+            widest = max([ppm.width for name, ppm in images] or [1])
+            sheetWidth = max(widest, int(area ** 0.5) + 1)
+
+        # shelf packing: tallest first, left to right, row by row
+        images.sort(key=lambda image: -image[1].height)
+        x = y = rowHeight = 0
+        for name, ppm in images:
+            if x + ppm.width > sheetWidth:
+                x = 0
+                y = y + rowHeight
+                rowHeight = 0
+            self.regions[name] = (x, y, ppm.width, ppm.height)
+            x = x + ppm.width
+            rowHeight = max(rowHeight, ppm.height)
+        self.width = sheetWidth
+        self.height = max(1, y + rowHeight)
+
+        self.pixels = bytearray(self.width * self.height * 3)
+        for name, ppm in images:
+            self._blit(name, ppm.pixels)
+            ppm.close()
+        self._sheet = None
+
+    def _blit(self, name, pixels):
+        x, y, width, height = self.regions[name]
+        row = width * 3
+        for i in range(height):
+            start = ((y + i) * self.width + x) * 3
+            self.pixels[start:start + row] = pixels[i*row:(i+1)*row]
+
+    def has(self, name):
+        return name in self.regions
+
+    def names(self):
+        return list(self.regions)
+
+    def getSheet(self):
+        """Returns the photo image holding the whole sheet"""
+        if self._sheet is None:
+            data = b"P6\n%d %d\n255\n" % (self.width, self.height) + bytes(self.pixels)
+            self._sheet = _backend.PhotoImage(data=data, format='ppm', master=_getRoot())
+        return self._sheet
+
+    def view(self, name):
+        """Returns a new photo image with the image name cut out of the sheet"""
+        x, y, width, height = self.regions[name]
+        photo = _backend.PhotoImage(master=_getRoot(), width=width, height=height)
+        _photoCopy(photo, self.getSheet(), x, y, width, height)
+        return photo
+
+    def getPixels(self, name):
+        """Returns (width, height, RGB bytes) of the image name"""
+        x, y, width, height = self.regions[name]
+        row = width * 3
+        rows = []
+        for i in range(height):
+            start = ((y + i) * self.width + x) * 3
+            rows.append(self.pixels[start:start + row])
+        return width, height, b"".join(rows)
+
+    def save(self, filename):
+        """Write the sheet to a PPM file and the regions to filename.idx,
+        so the atlas can be built ahead of time and read with load"""
+        writePPM(filename, self.width, self.height, self.pixels)
+        f = open(filename + '.idx', 'w')
+        try:
+            for name, region in sorted(self.regions.items()):
+                f.write("%s %d %d %d %d\n" % ((name,) + region))
+        finally:
+            f.close()
+
+    @staticmethod
+    def load(filename):
+        """Returns the TextureAtlas saved to filename"""
+        atlas = TextureAtlas()
+        ppm = readPPM(filename)
+        atlas.width = ppm.width
+        atlas.height = ppm.height
+        atlas.pixels = bytearray(ppm.pixels)
+        ppm.close()
+        f = open(filename + '.idx')
+        try:
+            for line in f:
+                fields = line.split()
+                if fields:
+                    atlas.regions[fields[0]] = tuple(map(int, fields[1:5]))
+        finally:
+            f.close()
+        return atlas
+
+def _loadPhoto(name):
+    # Make a photo image from a file. PPM files are read here and handed
+    # to the backend as data, other formats are left to the backend.
+    if not name.lower().endswith('.ppm'):
+        return _backend.PhotoImage(file=name, master=_getRoot())
+    ppm = readPPM(name)
+    try:
+        return _backend.PhotoImage(data=ppm.toData(), format='ppm', master=_getRoot())
+    except tk.TclError: # Tk without PPM data support
+        return _backend.PhotoImage(file=name, master=_getRoot())
+    finally:
+        ppm.close()
+
+class TextureCache:
+
+    """Shared store of decoded PhotoImages keyed by file name.
+
+    Every Image showing the same file uses the same PhotoImage, so a
+    file is read and decoded only once. Textures are reference counted
+    by the Images drawn with them. Textures nobody is drawing stay cached
+    until the total size goes over limit (in bytes), then the least
+    recently used ones are evicted."""
+
+    def __init__(self, limit=16*1024*1024):
+        self.limit = limit
+        self.size = 0
+        self.loads = 0
+        self.hits = 0
+        self.textures = OrderedDict() # name -> [photo, refs, bytes]
+        self.atlas = None
+
+    def _entry(self, name):
+        entry = self.textures.get(name)
+        if entry is None:
+            if self.atlas is not None and self.atlas.has(name):
+                photo = self.atlas.view(name)
+            else:
+                photo = _loadPhoto(name)
+            # Tk keeps 4 bytes per pixel for a photo image
+            entry = [photo, 0, photo.width()*photo.height()*4]
+            self.textures[name] = entry
+            self.size = self.size + entry[2]
+            self.loads = self.loads + 1
+        else:
+            self.textures.move_to_end(name)
+            self.hits = self.hits + 1
+        return entry
+
+    def get(self, name):
+        """Return the PhotoImage for file name without taking a reference"""
+        entry = self._entry(name)
+        self._evict(name)
+        return entry[0]
+
+    def acquire(self, name):
+        """Return the PhotoImage for file name and count one more user"""
+        entry = self._entry(name)
+        entry[1] = entry[1] + 1
+        self._evict()
+        return entry[0]
+
+    def release(self, name):
+        """Count one less user of file name. Returns silently if the
+        texture is not cached."""
+        entry = self.textures.get(name)
+        if entry is None: return
+        if entry[1] > 0:
+            entry[1] = entry[1] - 1
+        self._evict()
+
+    def refCount(self, name):
+        entry = self.textures.get(name)
+        if entry is None: return 0
+        return entry[1]
+
+    def setLimit(self, limit):
+        self.limit = limit
+        self._evict()
+
+    def clear(self):
+        """Drop every texture that is not in use"""
+        for name in list(self.textures):
+            entry = self.textures[name]
+            if entry[1] == 0:
+                del self.textures[name]
+                self.size = self.size - entry[2]
+
+    def _evict(self, keep=None):
+        # textures in use, and keep (just handed out), are never evicted
+        if self.size <= self.limit: return
+        for name in list(self.textures): # least recently used first
+            if self.size <= self.limit: break
+            entry = self.textures[name]
+            if entry[1] == 0 and name != keep:
+                del self.textures[name]
+                self.size = self.size - entry[2]
+
+_textures = TextureCache()
+
 class Image(GraphicsObject):
 
     idCount = 0
@@ -834,19 +1914,43 @@ class Image(GraphicsObject):
         self.anchor = p.clone()
         self.imageId = Image.idCount
         Image.idCount = Image.idCount + 1
-        if len(pixmap) == 1: # file name provided
-            self.img = tk.PhotoImage(file=pixmap[0], master=_root)
-        else: # width and height provided
-            width, height = pixmap
-            self.img = tk.PhotoImage(master=_root, width=width, height=height)
+        self.imageName = None
+        self.texture = None # name of the shared texture in use, if any
+        self.setImage(*pixmap)
 
     def setImage(self, *pixmap):
+        drawn = self.canvas and not self.canvas.isClosed()
+        if drawn and self.texture is not None:
+            _textures.release(self.texture)
         if len(pixmap) == 1: # file name provided
             self.imageName = pixmap[0]
-            self.img = tk.PhotoImage(file=pixmap[0], master=_root)
+            self.texture = pixmap[0]
+            if drawn:
+                self.img = _textures.acquire(self.texture)
+            else:
+                self.img = _textures.get(self.texture)
         else: # width and height provided
             width, height = pixmap
-            self.img = tk.PhotoImage(master=_root, width=width, height=height)
+            self.imageName = None
+            self.texture = None
+            self.img = _backend.PhotoImage(master=_getRoot(), width=width, height=height)
+        if drawn:
+            self.imageCache[self.imageId] = self.img
+            self.canvas._configure(self.id, {"image": self.img})
+            self.canvas._autoflush()
+
+    def _detach(self):
+        # Shared textures must not be modified in place. Give this
+        # Image a private copy before changing any pixels.
+        if self.texture is None: return
+        if self.canvas and not self.canvas.isClosed():
+            _textures.release(self.texture)
+            self.img = self.img.copy()
+            self.imageCache[self.imageId] = self.img
+            self.canvas._configure(self.id, {"image": self.img})
+        else:
+            self.img = self.img.copy()
+        self.texture = None
 
     def getImage(self):
        return self.imageName
@@ -854,6 +1958,8 @@ class Image(GraphicsObject):
     def _draw(self, canvas, options):
         p = self.anchor
         x,y = canvas.toScreen(p.x,p.y)
+        if self.texture is not None:
+            self.img = _textures.acquire(self.texture)
         self.imageCache[self.imageId] = self.img # save a reference  
         return canvas.create_image(x,y,image=self.img)
     
@@ -865,6 +1971,8 @@ class Image(GraphicsObject):
             del self.imageCache[self.imageId]  # allow gc of tk photoimage
         except KeyError:
             pass
+        if self.canvas and self.texture is not None:
+            _textures.release(self.texture)
         GraphicsObject.undraw(self)
 
     def getAnchor(self):
@@ -873,6 +1981,7 @@ class Image(GraphicsObject):
     def clone(self):
         other = Image(Point(0,0), 0, 0)
         other.img = self.img.copy()
+        other.imageName = self.imageName
         other.anchor = self.anchor.clone()
         other.config = self.config.copy()
         return other
@@ -901,7 +2010,61 @@ class Image(GraphicsObject):
         """Sets pixel (x,y) to the given color
         
         """
+        self._detach()
         self.img.put("{" + color +"}", (x, y))
+
+    def _region(self, x, y, width, height):
+        if width is None: width = self.getWidth() - x
+        if height is None: height = self.getHeight() - y
+        if x < 0 or y < 0 or width < 0 or height < 0 or \
+           x + width > self.getWidth() or y + height > self.getHeight():
+            raise GraphicsError("region is outside the image")
+        return width, height
+
+    def getPixels(self, x=0, y=0, width=None, height=None):
+        """Returns a bytearray with the RGB values of a region of the
+        image, row by row (3 bytes per pixel). By default the region
+        runs from (x,y) to the bottom right corner of the image.
+
+        """
+        width, height = self._region(x, y, width, height)
+        return _photoRead(self.img, x, y, width, height)
+
+    def setPixels(self, data, x=0, y=0, width=None):
+        """Writes RGB data (bytes, rows of 3 bytes per pixel, as returned
+        by getPixels) to the image with its top left corner at (x,y).
+        width is the width of the data in pixels, by default the rest of
+        the image's width.
+
+        """
+        if width is None: width = self.getWidth() - x
+        if width == 0 or len(data) % (width*3) != 0:
+            raise GraphicsError("data is not a whole number of rows")
+        height = len(data) // (width*3)
+        self._region(x, y, width, height)
+        self._detach()
+        _photoWrite(self.img, data, x, y, width, height)
+
+    def getArray(self, x=0, y=0, width=None, height=None):
+        """Returns a region of the image as a NumPy array of shape
+        (height, width, 3). Requires NumPy.
+
+        """
+        width, height = self._region(x, y, width, height)
+        try:
+            import numpy
+        except ImportError:
+            raise GraphicsError("getArray requires NumPy")
+        data = self.getPixels(x, y, width, height)
+        return numpy.frombuffer(data, dtype=numpy.uint8).reshape(height, width, 3)
+
+    def setArray(self, array, x=0, y=0):
+        """Writes a NumPy array of shape (height, width, 3) to the image
+        with its top left corner at (x,y).
+
+        """
+        height, width = array.shape[0], array.shape[1]
+        self.setPixels(array.astype('uint8').tobytes(), x, y, width)
         
 
     def save(self, filename):
@@ -912,7 +2075,10 @@ class Image(GraphicsObject):
         
         path, name = os.path.split(filename)
         ext = name.split(".")[-1]
-        self.img.write( filename, format=ext)
+        if ext.lower() == 'ppm':
+            writePPM(filename, self.getWidth(), self.getHeight(), self.getPixels())
+        else:
+            self.img.write( filename, format=ext)
 
         
 def color_rgb(r,g,b):
@@ -964,6 +2130,35 @@ def test():
     win.getMouse()
     win.close()
 
+def testPhotoRead():
+    """Check that _photoRead decodes what Tk's "photo data" returns. With
+    a display a real PhotoImage is read; without one a Tcl interpreter
+    makes the same tuple of rows."""
+    rgb = bytes([255,0,0, 0,255,0, 0,0,255, 255,255,255, 1,2,3, 250,128,7])
+    try:
+        root = tk.Tk()
+    except tk.TclError: # no display
+        root = None
+    if root is not None:
+        photo = tk.PhotoImage(master=root, width=3, height=2)
+        _photoWrite(photo, rgb, 0, 0, 3, 2)
+    else:
+        tcl = tk.Tcl()
+        class _Tk:
+            def call(self, name, option, fromOption, x0, y0, x1, y1):
+                rows = [" ".join(["#" + rgb[(y*3 + x)*3:(y*3 + x)*3 + 3].hex()
+                                  for x in range(x0, x1)]) for y in range(y0, y1)]
+                return tcl.call('list', *rows)
+        class _Photo: # answers "data" like a Tk photo image
+            name = 'photo'
+            tk = _Tk()
+        photo = _Photo()
+    assert bytes(_photoRead(photo, 0, 0, 3, 2)) == rgb
+    assert bytes(_photoRead(photo, 1, 1, 2, 1)) == rgb[12:]
+    if root is not None:
+        root.destroy()
+    print('photo read ok')
+
 if __name__ == "__main__":
     test()
 